@@ -1,19 +1,32 @@
 import os
 import sys
 import csv
+import importlib.util
 import sqlite3
 import hashlib
+import hmac
+import time
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from operator import mul
 from datetime import date
 from pathlib import Path
 
-from PyQt5.QtCore import Qt, QDate, QRegExp, QPoint, QSizeF, pyqtSignal, QProcess
-from PyQt5.QtGui import QRegExpValidator, QTextDocument
+from PyQt5.QtCore import (
+    Qt, QDate, QRegExp, QPoint, QSizeF, pyqtSignal, QProcess, QObject, QRunnable, QThreadPool,
+    QAbstractTableModel, QModelIndex, QTimer
+)
+from PyQt5.QtGui import (
+    QRegExpValidator, QTextDocument, QStandardItemModel, QStandardItem, QTextCursor,
+    QTextTableFormat, QTextCharFormat, QTextLength, QFont, QColor
+)
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QComboBox, QLineEdit, QPushButton, QHBoxLayout,
     QVBoxLayout, QFormLayout, QGridLayout, QMessageBox, QMainWindow, QAction, QDialog, QTableWidget,
     QTableWidgetItem, QHeaderView, QGroupBox, QSpinBox, QDateEdit, QRadioButton,
     QFileDialog, QStyledItemDelegate, QAbstractScrollArea, QAbstractItemView, QMenu,
-    QListWidget, QListWidgetItem, QCheckBox, QTextEdit
+    QListWidget, QListWidgetItem, QCheckBox, QTextEdit, QTableView, QCompleter
 )
 from PyQt5.QtPrintSupport import QPrinter
 from hmac import compare_digest as secure_eq
@@ -44,18 +57,36 @@ def enable_autosize(widget, w_ratio=0.9, h_ratio=0.85, min_w=1100, min_h=680):
     else:
         widget.resize(min_w, min_h)
 
-def stretch_table(table: QTableWidget):
+def stretch_table(table: QTableView):
     hh = table.horizontalHeader()
     hh.setSectionResizeMode(QHeaderView.Stretch)
     table.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
     table.setMinimumHeight(320)
 
-def zebra_table(table: QTableWidget, gray="#EEEEEE"):
+def zebra_table(table: QTableView, gray="#EEEEEE"):
+    # seletor QTableView também pega QTableWidget (subclasse)
     table.setAlternatingRowColors(True)
-    table.setStyleSheet(f"QTableWidget {{ alternate-background-color: {gray}; }}")
+    table.setStyleSheet(f"QTableView {{ alternate-background-color: {gray}; }}")
+
+def row_texts(table, r):
+    """Textos de uma linha do QTableWidget ("" para célula sem item), lidos uma vez só."""
+    item = table.item
+    return ["" if (it := item(r, c)) is None else it.text() for c in range(table.columnCount())]
+
+# flags padrão de QTableWidgetItem sem ItemIsEditable: aplicadas direto, sem ler/mascarar por célula
+RO_ITEM_FLAGS = (Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled
+                 | Qt.ItemIsDropEnabled | Qt.ItemIsUserCheckable)
+# flags devolvidas pelos modelos editáveis (flags() roda a cada pintura/edição de célula)
+MODEL_RO_FLAGS = Qt.ItemIsSelectable | Qt.ItemIsEnabled
+MODEL_RW_FLAGS = MODEL_RO_FLAGS | Qt.ItemIsEditable
+
+_ICON_CACHE = {}  # o app usa um único estilo: o ícone padrão de cada sp é sempre o mesmo
 
 def std_icon(widget, sp):
-    return widget.style().standardIcon(sp)
+    ic = _ICON_CACHE.get(sp)
+    if ic is None:
+        ic = _ICON_CACHE[sp] = widget.style().standardIcon(sp)
+    return ic
 
 def msg_info(text, parent=None):
     QMessageBox.information(parent, APP_TITLE, text)
@@ -71,11 +102,15 @@ def set_br_date(edit: QDateEdit):
     edit.setDisplayFormat("dd/MM/yyyy")
 
 def qdate_to_iso(qd: QDate) -> str:
-    return f"{qd.year():04d}-{qd.month():02d}-{qd.day():02d}"
+    return qd.toString(Qt.ISODate)  # "yyyy-MM-dd" formatado no C++
 
+@lru_cache(maxsize=4096)  # datas se repetem muito entre linhas/colunas das grades
 def iso_to_br(iso: str) -> str:
     if not iso:
         return ""
+    # caminho comum (datas gravadas por qdate_to_iso): só fatiar, sem converter
+    if len(iso) == 10 and iso[4] == "-" and iso[7] == "-":
+        return f"{iso[8:10]}/{iso[5:7]}/{iso[0:4]}"
     try:
         y, m, d = iso.split("-")
         return f"{int(d):02d}/{int(m):02d}/{int(y):04d}"
@@ -85,40 +120,73 @@ def iso_to_br(iso: str) -> str:
 # =============================================================================
 # Helpers BR + moeda
 # =============================================================================
-UF_SET = {
+UF_SET = frozenset({
     "AC","AL","AP","AM","BA","CE","DF","ES","GO","MA","MT","MS","MG","PA",
     "PB","PR","PE","PI","RJ","RN","RS","RO","RR","SC","SP","SE","TO"
-}
-def only_digits(s: str) -> str: return "".join(ch for ch in (s or "") if ch.isdigit())
-
-def format_cnpj(d: str) -> str:
-    d = only_digits(d);  return f"{d[0:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:14]}" if len(d)==14 else d
-def format_cpf(d: str) -> str:
-    d = only_digits(d);  return f"{d[0:3]}.{d[3:6]}.{d[6:9]}-{d[9:11]}" if len(d)==11 else d
+})
+# tabela de deleção (Latin-1 não-dígitos): str.translate limpa a string numa passada em C
+_NON_DIGITS = str.maketrans("", "", "".join(c for c in map(chr, range(256)) if not c.isdigit()))
+
+def only_digits(s: str) -> str:
+    d = (s or "").translate(_NON_DIGITS)
+    if not d or d.isdigit():
+        return d
+    return "".join(ch for ch in d if ch.isdigit())  # sobrou caractere fora do Latin-1
+
+# *_digits: recebem só dígitos (já limpos) — fatiam direto, sem varrer a string de novo
+def format_cnpj_digits(d: str) -> str:
+    return f"{d[0:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:14]}" if len(d)==14 else d
+def format_cpf_digits(d: str) -> str:
+    return f"{d[0:3]}.{d[3:6]}.{d[6:9]}-{d[9:11]}" if len(d)==11 else d
+def format_doc_digits(d: str) -> str:
+    """CPF (11) ou CNPJ (14); outros tamanhos ficam como estão."""
+    return format_cpf_digits(d) if len(d)==11 else format_cnpj_digits(d)
+# formatação completa (limpa + formata) em cache: recargas das grades repetem os mesmos valores
+@lru_cache(maxsize=4096)
+def format_cnpj(d: str) -> str: return format_cnpj_digits(only_digits(d))
+@lru_cache(maxsize=4096)
+def format_cpf(d: str) -> str: return format_cpf_digits(only_digits(d))
+@lru_cache(maxsize=4096)
+def format_cep(cep: str) -> str:
+    d = only_digits(cep);  return f"{d[:5]}-{d[5:]}" if len(d)==8 else (cep or "")
+# pesos dos dígitos verificadores (montados uma vez); os dígitos viram ints via bytes - 48
+_CNPJ_W1 = (5,4,3,2,9,8,7,6,5,4,3,2); _CNPJ_W2 = (6,) + _CNPJ_W1
+_CPF_W1 = tuple(range(10, 1, -1)); _CPF_W2 = tuple(range(11, 1, -1))
 def validate_cnpj(cnpj: str) -> bool:
     d = only_digits(cnpj)
-    if len(d) != 14 or d == d[0]*14: return False
-    def dv(nums, w): t=sum(int(n)*ww for n,ww in zip(nums,w)); r=t%11; return '0' if r<2 else str(11-r)
-    w1=[5,4,3,2,9,8,7,6,5,4,3,2]; w2=[6]+w1
-    return d[-2:]==dv(d[:12],w1)+dv(d[:12]+dv(d[:12],w1),w2)
+    if len(d) != 14 or d == d[0]*14 or not d.isascii(): return False
+    n = [c - 48 for c in d.encode("ascii")]
+    r = sum(map(mul, n, _CNPJ_W1)) % 11; dv1 = 0 if r < 2 else 11 - r
+    if n[12] != dv1: return False
+    r = sum(map(mul, n, _CNPJ_W2)) % 11; dv2 = 0 if r < 2 else 11 - r
+    return n[13] == dv2
 def validate_cpf(cpf: str) -> bool:
     d = only_digits(cpf)
-    if len(d)!=11 or d==d[0]*11: return False
-    def dv(nums,m): s=sum(int(nums[i])*(m-i) for i in range(len(nums))); r=(s*10)%11; return '0' if r==10 else str(r)
-    return d[-2:]==dv(d[:9],10)+dv(d[:9]+dv(d[:9],10),11)
+    if len(d)!=11 or d==d[0]*11 or not d.isascii(): return False
+    n = [c - 48 for c in d.encode("ascii")]
+    r = sum(map(mul, n, _CPF_W1)) * 10 % 11; dv1 = 0 if r == 10 else r
+    if n[9] != dv1: return False
+    r = sum(map(mul, n, _CPF_W2)) * 10 % 11; dv2 = 0 if r == 10 else r
+    return n[10] == dv2
 def validate_cep(cep: str) -> bool: return len(only_digits(cep))==8
 def validate_uf(uf: str) -> bool: return (uf or "").upper() in UF_SET
 
 def fmt_brl(v: float) -> str:
-    s = f"{float(v):,.2f}"
+    # + 0.0 normaliza -0.0 (igual a 0.0 para o cache, mas formataria "-0,00")
+    return _fmt_brl_cached(float(v) + 0.0)
+
+@lru_cache(maxsize=8192)  # valores (0,00, parcelas iguais...) se repetem nas grades
+def _fmt_brl_cached(v: float) -> str:
+    s = f"{v:,.2f}"
     return "R$ " + s.replace(",", "X").replace(".", ",").replace("X", ".")
 
+# "R$ 1.234,56" -> "1234.56" numa única passada: remove símbolo/milhar/espaços, vírgula vira ponto
+_BRL_TRANS = str.maketrans({"R": None, "$": None, ".": None, " ": None, "\xa0": None, ",": "."})
+
 def parse_brl(text: str) -> float:
     if text is None: return 0.0
-    s = str(text).strip()
+    s = str(text).translate(_BRL_TRANS)
     if not s: return 0.0
-    s = s.replace("R$", "").strip()
-    s = s.replace(".", "").replace(",", ".")
     try:
         return float(s)
     except Exception:
@@ -129,13 +197,180 @@ class BRLCurrencyLineEdit(QLineEdit):
         super().__init__(*a, **k)
         self.setAlignment(Qt.AlignRight)
     def focusOutEvent(self, e):
-        self.setText(fmt_brl(parse_brl(self.text())))
+        # texto já no formato final (ex.: só passou pelo campo com tab): sem setText
+        txt = self.text()
+        fmt = fmt_brl(parse_brl(txt))
+        if txt != fmt:
+            self.setText(fmt)
         super().focusOutEvent(e)
     def value(self) -> float:
         return parse_brl(self.text())
     def setValue(self, v: float):
         self.setText(fmt_brl(v))
 
+# =============================================================================
+# Modelos de tabela
+# =============================================================================
+class RowsTableModel(QAbstractTableModel):
+    """
+    Modelo somente-leitura sobre uma lista de tuplas já prontas para exibição
+    (texto, ou valores crus em colunas com delegate de formatação).
+    A view consulta apenas as células visíveis: nada de um QTableWidgetItem por célula.
+    As linhas são expostas em lotes (canFetchMore/fetchMore) conforme a rolagem,
+    então a view não dimensiona milhares de linhas de uma vez.
+    """
+    FETCH_BATCH = 500
+
+    def __init__(self, headers, align_right=(), parent=None):
+        super().__init__(parent)
+        self._headers = list(headers)
+        self._align_right = frozenset(align_right)
+        self._rows = []
+        self._shown = 0
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self._rows = rows
+        self._shown = min(len(rows), self.FETCH_BATCH)
+        self.endResetModel()
+
+    def row_at(self, r: int):
+        return self._rows[r]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._shown
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._shown < len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        n = min(len(self._rows) - self._shown, self.FETCH_BATCH)
+        if n <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._shown, self._shown + n - 1)
+        self._shown += n
+        self.endInsertRows()
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self._rows[index.row()][index.column()]
+        if role == Qt.TextAlignmentRole and index.column() in self._align_right:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self._headers[section]
+        return None
+
+class EditableRowsModel(QAbstractTableModel):
+    """
+    Modelo editável dos cadastros em grade: uma lista de valores por linha.
+    Só as células visíveis são lidas (sem QTableWidgetItem por célula) e cada
+    edição marca a linha em `dirty`, para o salvar gravar apenas o que mudou.
+    """
+    def __init__(self, headers, ro_cols=(), parent=None):
+        super().__init__(parent)
+        self._headers = list(headers)
+        ro_cols = frozenset(ro_cols)
+        # flags por coluna resolvidas uma vez: flags() só indexa
+        self._col_flags = [MODEL_RO_FLAGS if c in ro_cols else MODEL_RW_FLAGS for c in range(len(self._headers))]
+        self._rows = []
+        self.dirty = set()
+        self._fetch_more = None
+
+    def set_rows(self, rows, fetch_more=None):
+        """
+        fetch_more: opcional, () -> (linhas, há_mais); a view pede a próxima página
+        (canFetchMore/fetchMore) quando a rolagem chega ao fim do que já foi lido.
+        """
+        self.beginResetModel()
+        self._rows = [list(r) for r in rows]
+        self.dirty = set()
+        self._fetch_more = fetch_more
+        self.endResetModel()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._fetch_more is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._fetch_more is None:
+            return
+        rows, more = self._fetch_more()
+        if not more:
+            self._fetch_more = None
+        if rows:
+            r = len(self._rows)
+            self.beginInsertRows(QModelIndex(), r, r + len(rows) - 1)
+            self._rows.extend(list(v) for v in rows)
+            self.endInsertRows()
+
+    def fetch_all(self):
+        """Lê as páginas restantes (antes de acrescentar linhas novas no fim)."""
+        while self.canFetchMore():
+            self.fetchMore()
+
+    def text(self, r: int, c: int) -> str:
+        v = self._rows[r][c]
+        return "" if v is None else str(v)
+
+    def set_text(self, r: int, c: int, value):
+        self._rows[r][c] = value
+        ix = self.index(r, c)
+        self.dataChanged.emit(ix, ix)
+
+    def append_row(self, values) -> int:
+        r = len(self._rows)
+        self.beginInsertRows(QModelIndex(), r, r)
+        self._rows.append(list(values))
+        self.endInsertRows()
+        return r
+
+    def remove_row(self, r: int):
+        self.beginRemoveRows(QModelIndex(), r, r)
+        del self._rows[r]
+        self.endRemoveRows()
+        self.dirty = {d if d < r else d - 1 for d in self.dirty if d != r}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.text(index.row(), index.column())
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        r = index.row()
+        self._rows[r][index.column()] = "" if value is None else str(value)
+        self.dirty.add(r)
+        self.dataChanged.emit(index, index)
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return self._col_flags[index.column()]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self._headers[section]
+        return None
+
 # =============================================================================
 # Delegates (robustos a tipos)
 # =============================================================================
@@ -151,13 +386,16 @@ class MaskDelegate(QStyledItemDelegate):
         self.mask = mask
         self.regex = regex
         self.uppercase = uppercase
+        # um validador (regex compilada) por delegate, compartilhado pelos editores:
+        # o QLineEdit não assume a posse do validador
+        self._validator = QRegExpValidator(QRegExp(regex), self) if regex else None
 
     def createEditor(self, parent, option, index):
         ed = QLineEdit(parent)
         if self.mask:
             ed.setInputMask(self.mask)
-        if self.regex:
-            ed.setValidator(QRegExpValidator(QRegExp(self.regex), ed))
+        if self._validator is not None:
+            ed.setValidator(self._validator)
         return ed
 
     def setEditorData(self, editor, index):
@@ -293,9 +531,30 @@ class AccountTypeDelegate(QStyledItemDelegate):
     def setModelData(self, editor, model, index):
         model.setData(index, editor.currentText())
 
+class BRLDelegate(QStyledItemDelegate):
+    """
+    Exibe em R$ uma coluna cujo modelo guarda o valor numérico cru.
+    A formatação sai do cache de fmt_brl, só para as células pintadas.
+    """
+    def displayText(self, value, locale):
+        if value is None:
+            return ""
+        return fmt_brl(value if isinstance(value, (int, float)) else parse_brl(value))
+
 # =============================================================================
 # DB schema / seed
 # =============================================================================
+# definição atual da view, exatamente como o SQLite a guarda em sqlite_master.sql
+# (sem IF NOT EXISTS nem ';'): migrate_schema() compara o texto para saber se recria
+VW_TRANSACTIONS_LISTA_SQL = """CREATE VIEW vw_transactions_lista AS
+SELECT t.id, t.company_id, t.tipo, t.entity_id, t.category_id, t.subcategory_id,
+       t.descricao, t.data_lanc, t.data_venc, t.forma_pagto, t.parcelas_qtd, t.valor,
+       CASE WHEN t.status='LIQUIDADO' THEN 'LIQUIDADO'
+            WHEN t.data_venc < date('now') THEN 'ATRASADO'
+            ELSE 'EM_ABERTO' END AS status_calc,
+       ROUND(t.pago, 2) AS total_pago
+FROM transactions t"""
+
 SCHEMA_SQL = r"""
 PRAGMA foreign_keys = ON;
 
@@ -313,6 +572,7 @@ CREATE TABLE IF NOT EXISTS users (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT NOT NULL, username TEXT NOT NULL UNIQUE,
   password_salt BLOB NOT NULL, password_hash BLOB NOT NULL, iterations INTEGER NOT NULL,
+  kdf TEXT NOT NULL DEFAULT 'pbkdf2',
   is_admin INTEGER NOT NULL DEFAULT 0, created_at TEXT NOT NULL DEFAULT (datetime('now')),
   active INTEGER NOT NULL DEFAULT 1
 );
@@ -381,7 +641,8 @@ CREATE TABLE IF NOT EXISTS transactions (
   status TEXT NOT NULL DEFAULT 'EM_ABERTO' CHECK (status IN ('EM_ABERTO','LIQUIDADO','CANCELADO')),
   banco_id_padrao INTEGER REFERENCES bank_accounts(id),
   created_by INTEGER REFERENCES users(id),
-  created_at TEXT NOT NULL DEFAULT (datetime('now')), updated_at TEXT
+  created_at TEXT NOT NULL DEFAULT (datetime('now')), updated_at TEXT,
+  pago REAL NOT NULL DEFAULT 0  -- soma de (amount + interest - discount), mantida pelos triggers de payments
 );
 
 CREATE TABLE IF NOT EXISTS payments (
@@ -412,21 +673,40 @@ CREATE TABLE IF NOT EXISTS audit_log (
 );
 
 CREATE INDEX IF NOT EXISTS idx_trans_company_venc ON transactions(company_id, data_venc);
+CREATE INDEX IF NOT EXISTS idx_trans_company_lanc ON transactions(company_id, data_lanc);
 CREATE INDEX IF NOT EXISTS idx_trans_status ON transactions(status);
 CREATE INDEX IF NOT EXISTS idx_payments_tx ON payments(transaction_id);
 CREATE INDEX IF NOT EXISTS idx_payments_date ON payments(payment_date);
+CREATE INDEX IF NOT EXISTS idx_payments_company_date ON payments(company_id, payment_date);
 CREATE INDEX IF NOT EXISTS idx_entities_company ON entities(company_id);
 CREATE INDEX IF NOT EXISTS idx_bank_company ON bank_accounts(company_id);
-
-CREATE VIEW IF NOT EXISTS vw_transactions_lista AS
-SELECT t.id, t.company_id, t.tipo, t.entity_id, t.category_id, t.subcategory_id,
-       t.descricao, t.data_lanc, t.data_venc, t.forma_pagto, t.parcelas_qtd, t.valor,
-       CASE WHEN t.status='LIQUIDADO' THEN 'LIQUIDADO'
-            WHEN date(t.data_venc) < date('now') THEN 'ATRASADO'
-            ELSE 'EM_ABERTO' END AS status_calc,
-       IFNULL((SELECT ROUND(SUM(p.amount + p.interest - p.discount), 2)
-               FROM payments p WHERE p.transaction_id=t.id), 0) AS total_pago
-FROM transactions t;
+CREATE INDEX IF NOT EXISTS idx_cat_company_tipo_name ON categories(company_id, tipo, name);
+CREATE INDEX IF NOT EXISTS idx_payments_tx_date ON payments(transaction_id, payment_date);
+CREATE INDEX IF NOT EXISTS idx_entities_company_name ON entities(company_id, razao_social);
+CREATE INDEX IF NOT EXISTS idx_trans_company_tipo_venc ON transactions(company_id, tipo, data_venc);
+CREATE INDEX IF NOT EXISTS idx_entities_company_kind ON entities(company_id, kind);
+CREATE INDEX IF NOT EXISTS idx_companies_razao ON companies(razao_social, id);
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_ai AFTER INSERT ON payments BEGIN
+  UPDATE transactions SET pago = pago + (NEW.amount + NEW.interest - NEW.discount)
+   WHERE id = NEW.transaction_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_ad AFTER DELETE ON payments BEGIN
+  UPDATE transactions SET pago = pago - (OLD.amount + OLD.interest - OLD.discount)
+   WHERE id = OLD.transaction_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_au AFTER UPDATE OF transaction_id, amount, interest, discount ON payments BEGIN
+  UPDATE transactions SET pago = pago - (OLD.amount + OLD.interest - OLD.discount)
+   WHERE id = OLD.transaction_id;
+  UPDATE transactions SET pago = pago + (NEW.amount + NEW.interest - NEW.discount)
+   WHERE id = NEW.transaction_id;
+END;
+
+-- total_pago vem da coluna mantida pelos triggers de payments (sem subconsulta por linha);
+-- bancos com a definição antiga são atualizados uma vez em migrate_schema()
+""" + VW_TRANSACTIONS_LISTA_SQL.replace("CREATE VIEW", "CREATE VIEW IF NOT EXISTS", 1) + r""";
 
 CREATE VIEW IF NOT EXISTS vw_fluxo_caixa AS
 SELECT p.company_id, p.payment_date AS data, b.bank_name, b.account_name,
@@ -456,63 +736,236 @@ JOIN transactions t ON t.id=p.transaction_id
 GROUP BY p.company_id, ano, mes, t.tipo, t.category_id;
 """
 
-SEED_SQL = r"""
-INSERT OR IGNORE INTO permission_types(code, name, description) VALUES
-  ('CONTAS','Contas a Pagar/Receber','Acesso a lançamentos e baixas'),
-  ('BANCOS','Cadastro de Bancos','Manter contas bancárias'),
-  ('FORNECEDOR_CLIENTE','Fornecedor/Cliente','Cadastro de entidades'),
-  ('NFE','Emissão NFS-e','Acesso a NFS-e'),
-  ('DRE','DRE','Relatório de resultados');
-
-INSERT OR IGNORE INTO companies (id, cnpj, razao_social, cidade, uf)
-VALUES (1,'00000000000000','EMPRESA DEMONSTRAÇÃO LTDA','Campo Grande','MS');
-
-INSERT OR IGNORE INTO bank_accounts(company_id, bank_name, account_name, account_type, initial_balance, current_balance)
-VALUES (1,'CAIXA','Caixa','CAIXA',0,0);
-
-INSERT OR IGNORE INTO categories(company_id, name, tipo) VALUES
- (1,'PRESTACAO DE SERVICOS','RECEBER'),
- (1,'RETENCOES DE IMPOSTOS','PAGAR'),
- (1,'DESPESAS OPERACIONAIS','PAGAR'),
- (1,'DESPESAS DE ESCRITORIO','PAGAR'),
- (1,'RECEITAS BANCARIAS','RECEBER');
-
-INSERT OR IGNORE INTO subcategories (category_id, name)
-SELECT id,'OUTROS' FROM categories WHERE company_id=1 AND name='DESPESAS OPERACIONAIS' AND tipo='PAGAR';
-"""
+# dados iniciais em listas: gravados com executemany (statement compilado uma vez)
+SEED_PERMISSION_TYPES = [
+    ("CONTAS", "Contas a Pagar/Receber", "Acesso a lançamentos e baixas"),
+    ("BANCOS", "Cadastro de Bancos", "Manter contas bancárias"),
+    ("FORNECEDOR_CLIENTE", "Fornecedor/Cliente", "Cadastro de entidades"),
+    ("NFE", "Emissão NFS-e", "Acesso a NFS-e"),
+    ("DRE", "DRE", "Relatório de resultados"),
+]
+SEED_CATEGORIES = [
+    (1, "PRESTACAO DE SERVICOS", "RECEBER"),
+    (1, "RETENCOES DE IMPOSTOS", "PAGAR"),
+    (1, "DESPESAS OPERACIONAIS", "PAGAR"),
+    (1, "DESPESAS DE ESCRITORIO", "PAGAR"),
+    (1, "RECEITAS BANCARIAS", "RECEBER"),
+]
+
+def seed_base(conn: sqlite3.Connection) -> None:
+    """Empresa/caixa de demonstração, tipos de permissão e categorias iniciais (sem COMMIT)."""
+    conn.executemany("INSERT OR IGNORE INTO permission_types(code, name, description) VALUES (?,?,?)",
+                     SEED_PERMISSION_TYPES)
+    conn.execute("""INSERT OR IGNORE INTO companies (id, cnpj, razao_social, cidade, uf)
+                    VALUES (1,'00000000000000','EMPRESA DEMONSTRAÇÃO LTDA','Campo Grande','MS')""")
+    conn.execute("""INSERT OR IGNORE INTO bank_accounts(company_id, bank_name, account_name, account_type,
+                                                        initial_balance, current_balance)
+                    VALUES (1,'CAIXA','Caixa','CAIXA',0,0)""")
+    conn.executemany("INSERT OR IGNORE INTO categories(company_id, name, tipo) VALUES (?,?,?)",
+                     SEED_CATEGORIES)
+    conn.execute("""INSERT OR IGNORE INTO subcategories (category_id, name)
+                    SELECT id,'OUTROS' FROM categories
+                     WHERE company_id=1 AND name='DESPESAS OPERACIONAIS' AND tipo='PAGAR'""")
 
 # =============================================================================
 # Conexão / hashing
 # =============================================================================
+# senhas novas usam scrypt (memory-hard); users.iterations guarda o custo do kdf
+# (N no scrypt, nº de iterações no PBKDF2 legado)
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 15, 8, 1
+
 def pbkdf2_hash(password: str, salt: bytes, iterations: int) -> bytes:
     return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
 
+def scrypt_hash(password: str, salt: bytes, n: int = SCRYPT_N) -> bytes:
+    # 128*r*N = 32 MiB de trabalho; maxmem acima do padrão (32 MiB) do OpenSSL
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=SCRYPT_R, p=SCRYPT_P,
+                          maxmem=64 * 1024 * 1024, dklen=32)
+
+def password_hash(password: str, salt: bytes, kdf: str, cost: int) -> bytes:
+    if kdf == "scrypt":
+        return scrypt_hash(password, salt, cost)
+    return pbkdf2_hash(password, salt, cost)
+
+def new_password_record(password: str):
+    """(salt, hash, kdf, custo) para gravar uma senha nova."""
+    salt = os.urandom(16)
+    return salt, scrypt_hash(password, salt), "scrypt", SCRYPT_N
+
+class _KdfSignals(QObject):
+    done = pyqtSignal(bytes, object)
+
+class KdfRunnable(QRunnable):
+    """
+    Calcula o hash da senha numa thread do QThreadPool e devolve via sinal
+    done(hash, novo_registro). Com expected (o hash gravado) e KDF diferente de
+    scrypt, uma senha que confere já sai daqui também com o registro scrypt novo
+    (new_password_record), para a migração não rodar o KDF na thread da UI.
+    """
+    def __init__(self, password: str, salt: bytes, kdf: str, cost: int, expected: bytes = None):
+        super().__init__()
+        self.password = password; self.salt = salt; self.kdf = kdf; self.cost = cost
+        self.expected = expected
+        self.signals = _KdfSignals()
+    def run(self):
+        calc = password_hash(self.password, self.salt, self.kdf, self.cost)
+        record = None
+        if self.expected is not None and self.kdf != "scrypt" and secure_eq(calc, bytes(self.expected)):
+            record = new_password_record(self.password)
+        self.signals.done.emit(calc, record)
+
+# conexões de leitura dos jobs do pool, por arquivo: cada job pega uma livre e a devolve
+# ao terminar. As threads do QThreadPool não são threads Python (threading.local não
+# sobrevive entre run()s) e podem ser recicladas, por isso o cache não é por thread;
+# check_same_thread=False é seguro porque cada conexão só está com um job por vez.
+_reader_free = {}
+_reader_lock = threading.Lock()
+
+def _reader_acquire(path):
+    with _reader_lock:
+        free = _reader_free.get(path)
+        if free:
+            return free.pop()
+    # conexão de leitura: query_only barra escrita acidental fora da conexão
+    # principal (a única RW, na thread da UI)
+    db = DB(sqlite3.connect(path, cached_statements=512, check_same_thread=False))
+    db.conn.execute("PRAGMA query_only=1")
+    return db
+
+def _reader_release(path, db):
+    with _reader_lock:
+        _reader_free.setdefault(path, []).append(db)
+
+class _QuerySignals(QObject):
+    done = pyqtSignal(object)
+
+class QueryRunnable(QRunnable):
+    """
+    Executa fn(db, *args) numa thread do QThreadPool, com uma conexão SQLite de
+    leitura emprestada de _reader_free (em WAL a leitura não bloqueia a UI nem as
+    gravações), e devolve o resultado — ou a exceção — via sinal.
+    """
+    def __init__(self, path: str, fn, *args):
+        super().__init__()
+        self.path = path; self.fn = fn; self.args = args
+        self.signals = _QuerySignals()
+    def run(self):
+        db = None
+        try:
+            db = _reader_acquire(self.path)
+            result = self.fn(db, *self.args)
+        except Exception as e:
+            result = e
+        finally:
+            if db is not None:
+                if db.conn.in_transaction:
+                    db.conn.rollback()  # não segura snapshot WAL enquanto parada
+                _reader_release(self.path, db)
+        self.signals.done.emit(result)
+
+def start_query(db, fn, *args, on_done):
+    """
+    Dispara fn(db, *args) no pool e chama on_done(resultado) na thread da UI.
+    Banco em memória não tem como ser aberto por outra conexão: roda direto.
+    Devolve o job (o chamador guarda a referência enquanto ele estiver ativo).
+    """
+    if not db.path:
+        try:
+            result = fn(db, *args)
+        except Exception as e:
+            result = e
+        on_done(result)
+        return None
+    job = QueryRunnable(db.path, fn, *args)
+    job.signals.done.connect(on_done)
+    QThreadPool.globalInstance().start(job)
+    return job
+
+class TaskRunnable(QRunnable):
+    """Executa fn(*args) (sem banco) numa thread do QThreadPool; resultado ou exceção via sinal."""
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn; self.args = args
+        self.signals = _QuerySignals()
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            result = e
+        self.signals.done.emit(result)
+
+_task_jobs = set()  # referências vivas até o fim de cada tarefa
+
+def start_task(fn, *args, on_done):
+    """Dispara fn(*args) no pool e chama on_done(resultado) na thread da UI."""
+    job = TaskRunnable(fn, *args)
+    _task_jobs.add(job)
+    def _done(result, job=job):
+        _task_jobs.discard(job)
+        on_done(result)
+    job.signals.done.connect(_done)
+    QThreadPool.globalInstance().start(job)
+    return job
+
+def migrate_schema(conn: sqlite3.Connection) -> None:
+    """Ajustes em bancos criados por versões anteriores do schema (idempotente)."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(transactions)")}
+    if "pago" not in cols:
+        with conn:
+            conn.execute("ALTER TABLE transactions ADD COLUMN pago REAL NOT NULL DEFAULT 0")
+            conn.execute("""
+                UPDATE transactions
+                   SET pago = IFNULL((SELECT SUM(p.amount + p.interest - p.discount)
+                                        FROM payments p WHERE p.transaction_id = transactions.id), 0)
+            """)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(users)")}
+    if "kdf" not in cols:
+        with conn:  # usuários existentes seguem em PBKDF2 até o próximo login
+            conn.execute("ALTER TABLE users ADD COLUMN kdf TEXT NOT NULL DEFAULT 'pbkdf2'")
+    # view recriada só quando a definição gravada difere da atual (trocar o schema a
+    # cada abertura travaria o banco e invalidaria os statements das outras conexões)
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='view' AND name='vw_transactions_lista'"
+    ).fetchone()
+    if row is None or row[0] != VW_TRANSACTIONS_LISTA_SQL:
+        with conn:
+            conn.execute("DROP VIEW IF EXISTS vw_transactions_lista")
+            conn.execute(VW_TRANSACTIONS_LISTA_SQL)
+
 def ensure_db():
     path = Path(DB_FILE)
     first = not path.exists()
-    conn = sqlite3.connect(path)
+    # cache de statements bem maior que o padrão (128): o app tem muitos SQLs
+    # distintos e a evicção forçaria novo prepare nas consultas quentes
+    conn = sqlite3.connect(path, cached_statements=512)
+    # WAL já na criação/migração: o modo é persistente no arquivo, então schema e
+    # seed do primeiro uso também saem com um fsync por checkpoint
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     conn.execute("PRAGMA foreign_keys = ON;")
     conn.executescript(SCHEMA_SQL)
+    migrate_schema(conn)
+    # estatísticas iniciais para o planner enxergar os índices compostos
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone():
+        conn.execute("ANALYZE")
     if first:
-        conn.executescript(SEED_SQL)
+        # primeira execução: seed + admin + categorias padrão numa única transação
+        # (um COMMIT/fsync); o primeiro INSERT abre a transação implicitamente
+        seed_base(conn)
         cur = conn.cursor()
-        salt = os.urandom(16); iters = 240_000
-        pw_hash = pbkdf2_hash("admin123", salt, iters)
-        cur.execute("""INSERT INTO users(name, username, password_salt, password_hash, iterations, is_admin, active)
-                       VALUES(?,?,?,?,?,1,1)""", ("Administrador","admin",salt,pw_hash,iters))
+        salt, pw_hash, kdf, cost = new_password_record("admin123")
+        cur.execute("""INSERT INTO users(name, username, password_salt, password_hash, iterations, kdf, is_admin, active)
+                       VALUES(?,?,?,?,?,?,1,1)""", ("Administrador","admin",salt,pw_hash,cost,kdf))
         admin_id = cur.lastrowid
         cur.execute("INSERT OR IGNORE INTO user_company_access(user_id, company_id) VALUES(?,1)", (admin_id,))
-        for (pid,) in conn.execute("SELECT id FROM permission_types"):
-            conn.execute("INSERT OR REPLACE INTO user_permissions(user_id,perm_id,allowed) VALUES(?,?,1)",
-                         (admin_id, pid))
-        conn.execute("INSERT OR REPLACE INTO app_meta(key,value) VALUES('schema_version','1')")
-        conn.commit()
+        perms = [(admin_id, pid) for (pid,) in conn.execute("SELECT id FROM permission_types")]
+        cur.executemany("INSERT OR REPLACE INTO user_permissions(user_id,perm_id,allowed) VALUES(?,?,1)",
+                        perms)
+        cur.execute("INSERT OR REPLACE INTO app_meta(key,value) VALUES('schema_version','1')")
 
     # <<< ADICIONE ESTA LINHA >>>
-    seed_default_categories(conn)
-
-    conn.row_factory = sqlite3.Row
-    return conn
+    seed_default_categories(conn)  # comita (no primeiro uso, junto com o seed acima)
+    return conn  # row_factory/PRAGMAs de sessão ficam a cargo do DB
 def seed_default_categories(conn: sqlite3.Connection) -> None:
     """
     Garante categorias/subcategorias padrão:
@@ -560,19 +1013,163 @@ def seed_default_categories(conn: sqlite3.Connection) -> None:
 # Dados
 # =============================================================================
 class DB:
+    # SQL de gravação com parâmetros :nomeados — recebem o próprio dict do registro
+    # (chaves extras são ignoradas), inclusive em executemany
+    PAYMENT_INSERT_SQL = """
+        INSERT INTO payments
+            (transaction_id, company_id, payment_date, bank_id, amount, interest, discount, doc_ref, created_by)
+        VALUES (:transaction_id, :company_id, :payment_date, :bank_id, :amount, :interest, :discount,
+                :doc_ref, :created_by)
+    """
+    COMPANY_COLS = ("cnpj", "razao_social", "contato1", "contato2", "rua", "bairro", "numero",
+                    "cep", "uf", "cidade", "email")
+    COMPANY_INSERT_SQL = """
+        INSERT INTO companies
+            (cnpj, razao_social, contato1, contato2, rua, bairro, numero, cep, uf, cidade, email, active)
+        VALUES (:cnpj, :razao_social, :contato1, :contato2, :rua, :bairro, :numero, :cep, :uf,
+                :cidade, :email, :active)
+    """
+    COMPANY_UPDATE_SQL = """
+        UPDATE companies
+           SET cnpj=:cnpj, razao_social=:razao_social, contato1=:contato1, contato2=:contato2,
+               rua=:rua, bairro=:bairro, numero=:numero, cep=:cep, uf=:uf, cidade=:cidade,
+               email=:email, active=:active
+         WHERE id=:id
+    """
+    BANK_COLS = ("bank_name", "account_name", "account_type", "agency", "account_number")
+    BANK_INSERT_SQL = """
+        INSERT INTO bank_accounts
+            (company_id, bank_name, account_name, account_type, agency, account_number,
+             initial_balance, current_balance, active)
+        VALUES (:company_id, :bank_name, :account_name, :account_type, :agency, :account_number,
+                :initial_balance, :current_balance, :active)
+    """
+    BANK_UPDATE_SQL = """
+        UPDATE bank_accounts
+           SET bank_name=:bank_name, account_name=:account_name, account_type=:account_type,
+               agency=:agency, account_number=:account_number, initial_balance=:initial_balance,
+               current_balance=:current_balance, active=:active
+         WHERE id=:id
+    """
+    ENTITY_COLS = ("kind", "cnpj_cpf", "razao_social", "contato1", "contato2", "rua", "bairro",
+                   "numero", "cep", "uf", "cidade", "email")
+    ENTITY_INSERT_SQL = """
+        INSERT INTO entities
+            (company_id, kind, cnpj_cpf, razao_social, contato1, contato2, rua, bairro, numero, cep, uf, cidade, email, active)
+        VALUES (:company_id, :kind, :cnpj_cpf, :razao_social, :contato1, :contato2, :rua, :bairro, :numero,
+                :cep, :uf, :cidade, :email, :active)
+    """
+    ENTITY_UPDATE_SQL = """
+        UPDATE entities
+           SET kind=:kind, cnpj_cpf=:cnpj_cpf, razao_social=:razao_social, contato1=:contato1,
+               contato2=:contato2, rua=:rua, bairro=:bairro, numero=:numero, cep=:cep, uf=:uf,
+               cidade=:cidade, email=:email, active=:active
+         WHERE id=:id
+    """
+    CATEGORY_INSERT_SQL = "INSERT INTO categories(company_id, name, tipo) VALUES (:company_id, :name, :tipo)"
+    CATEGORY_UPDATE_SQL = "UPDATE categories SET name=:name, tipo=:tipo WHERE id=:id"
+    SUBCATEGORY_INSERT_SQL = "INSERT INTO subcategories(category_id, name) VALUES (:category_id, :name)"
+    SUBCATEGORY_UPDATE_SQL = "UPDATE subcategories SET name=:name, category_id=:category_id WHERE id=:id"
+    TRANSACTION_INSERT_SQL = """
+        INSERT INTO transactions
+            (company_id, tipo, entity_id, category_id, subcategory_id, descricao,
+             data_lanc, data_venc, forma_pagto, parcelas_qtd, valor, status,
+             banco_id_padrao, created_by)
+        VALUES (:company_id, :tipo, :entity_id, :category_id, :subcategory_id, :descricao,
+                :data_lanc, :data_venc, :forma_pagto, :parcelas_qtd, :valor, 'EM_ABERTO',
+                :banco_id_padrao, :created_by)
+    """
+    TRANSACTION_UPDATE_SQL = """
+        UPDATE transactions
+           SET tipo=:tipo, entity_id=:entity_id, category_id=:category_id, subcategory_id=:subcategory_id,
+               descricao=:descricao, data_lanc=:data_lanc, data_venc=:data_venc, forma_pagto=:forma_pagto,
+               parcelas_qtd=:parcelas_qtd, valor=:valor, banco_id_padrao=:banco_id_padrao,
+               updated_at=datetime('now')
+         WHERE id=:id
+    """
+
     def __init__(self, conn: sqlite3.Connection):
         self.conn = conn
         self.conn.row_factory = sqlite3.Row
+        # WAL + synchronous=NORMAL: um fsync por checkpoint em vez de um por commit,
+        # e leituras (DRE/fluxo) não bloqueiam as gravações. WAL só vale para arquivo.
+        main_file = self.conn.execute("PRAGMA database_list").fetchone()[2]
+        self.path = main_file  # "" para banco em memória
+        if main_file:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA temp_store=MEMORY;"
+            "PRAGMA mmap_size=268435456;"
+            "PRAGMA cache_size=-65536;"
+            "PRAGMA foreign_keys=ON;"
+        )
+        self._dre_sql = self._build_dre_sql()
+        self._in_tx = False
+        # cursor dedicado: mesmo SQL no mesmo cursor reaproveita o statement compilado
+        self._stmt_payment_add = self.conn.cursor()
+        self._stmt_cache = {}
+        # ACL da sessão: is_admin/allowed_codes são consultados a cada menu/diálogo;
+        # invalidados pelos métodos que gravam usuários e permissões
+        self._admin_cache = {}
+        self._perm_cache = {}
+        # permission_types só muda no seed: carregada na primeira consulta
+        self._perm_types = None
+
+    def close(self):
+        # atualiza as estatísticas do planner para as próximas sessões
+        try:
+            self.conn.execute("PRAGMA optimize;")
+        finally:
+            self.conn.close()
 
     # utilidades básicas
     def q(self, sql, params=()):
-        return self.conn.execute(sql, params).fetchall()
+        # um cursor por texto SQL: consultas repetidas (lookups por id, combos)
+        # reaproveitam o cursor e o statement já compilado
+        cur = self._stmt_cache.get(sql)
+        if cur is None:
+            cur = self._stmt_cache[sql] = self.conn.cursor()
+        return cur.execute(sql, params).fetchall()
 
     def e(self, sql, params=()):
         cur = self.conn.execute(sql, params)
-        self.conn.commit()
+        if not self._in_tx:
+            self.conn.commit()
         return cur.lastrowid
 
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa várias gravações num único COMMIT (self.e não comita dentro do bloco).
+        Em caso de exceção, desfaz tudo. Blocos aninhados participam do externo.
+        """
+        if self._in_tx:
+            yield
+            return
+        self._in_tx = True
+        try:
+            with self.conn:
+                yield
+        finally:
+            self._in_tx = False
+
+    def _bulk_save(self, params, insert_sql, update_sql):
+        """UPDATEs (p["id"] preenchido) num executemany; INSERTs um a um (precisamos do lastrowid)."""
+        ids = []
+        with self.transaction():
+            updates = [p for p in params if p["id"]]
+            if updates:
+                self.conn.executemany(update_sql, updates)
+            cur = self.conn.cursor()
+            for p in params:
+                rid = p["id"]
+                if not rid:
+                    cur.execute(insert_sql, p)
+                    rid = cur.lastrowid
+                ids.append(rid)
+        return ids
+
     # ---------------------- LOGIN / ACL ----------------------
     def list_companies(self):
         return self.q(
@@ -589,85 +1186,105 @@ class DB:
         """
         return self.q(sql, (company_id,))
 
+    # SQLs das consultas mais frequentes como constantes da classe: o mesmo objeto
+    # str a cada chamada, sempre achado no cache de statements da conexão
+    _SQL_USER_LOGIN = "SELECT * FROM users WHERE username=? AND active=1"
+    _SQL_USER_COMPANY_OK = "SELECT 1 FROM user_company_access WHERE user_id=? AND company_id=?"
+    _SQL_IS_ADMIN = "SELECT is_admin FROM users WHERE id=?"
+
+    def login_user(self, username):
+        """Linha do usuário ativo (ou None); o hash da senha é conferido em finish_login."""
+        rows = self.q(self._SQL_USER_LOGIN, (username,))
+        return rows[0] if rows else None
+
     def verify_login(self, company_id, username, password):
-        rows = self.q(
-            "SELECT * FROM users WHERE username=? AND active=1", (username,)
-        )
-        if not rows:
+        u = self.login_user(username)
+        if u is None:
             return None
-        u = rows[0]
-        calc = pbkdf2_hash(password, u["password_salt"], u["iterations"])
+        calc = password_hash(password, u["password_salt"], u["kdf"], u["iterations"])
+        return self.finish_login(company_id, u, password, calc)
+
+    def finish_login(self, company_id, u, password, calc, new_record=None):
+        """
+        Conclui o login com o hash já calculado (calc), p.ex. por um KdfRunnable:
+        confere a senha, migra para scrypt e valida o acesso à empresa.
+        new_record: registro scrypt já calculado fora da UI (KdfRunnable com expected);
+        sem ele a migração calcula aqui mesmo (caminho síncrono de verify_login).
+        """
         if not secure_eq(calc, u["password_hash"]):
             return None
-        ok = self.q(
-            "SELECT 1 FROM user_company_access WHERE user_id=? AND company_id=?",
-            (u["id"], company_id),
-        )
+        if u["kdf"] != "scrypt":
+            # senha conferida: regrava em scrypt (migração transparente do PBKDF2)
+            self.user_set_password(u["id"], password, new_record)
+        ok = self.q(self._SQL_USER_COMPANY_OK, (u["id"], company_id))
         if not ok:
             return None
         return u
 
     def is_admin(self, user_id):
-        r = self.q("SELECT is_admin FROM users WHERE id=?", (user_id,))
-        return bool(r and r[0]["is_admin"])
+        adm = self._admin_cache.get(user_id)
+        if adm is None:
+            r = self.q(self._SQL_IS_ADMIN, (user_id,))
+            adm = self._admin_cache[user_id] = bool(r and r[0]["is_admin"])
+        return adm
+
+    def _forget_acl(self, user_id):
+        self._admin_cache.pop(user_id, None)
+        self._perm_cache.pop(user_id, None)
 
     # ---------------------- COMPANIES ----------------------
-    def companies_all(self):
-        return self.q("SELECT * FROM companies ORDER BY razao_social")
+    # created_br: data já em dd/mm/aaaa, formatada pelo SQLite
+    _SQL_COMPANIES_PAGE = (
+        "SELECT *, strftime('%d/%m/%Y', created_at) AS created_br FROM companies{where}"
+        " ORDER BY razao_social, id LIMIT ?"
+    )
+    _SQL_COMPANIES_FIRST = _SQL_COMPANIES_PAGE.format(where="")
+    _SQL_COMPANIES_AFTER = _SQL_COMPANIES_PAGE.format(where=" WHERE (razao_social, id) > (?, ?)")
+
+    def companies_page(self, after=None, limit=500):
+        """
+        Página de empresas por razão social, paginada por chave (sem OFFSET):
+        after = (razao_social, id) da última linha já carregada, ou None para a primeira.
+        """
+        if after is None:
+            return self.q(self._SQL_COMPANIES_FIRST, (limit,))
+        return self.q(self._SQL_COMPANIES_AFTER, (*after, limit))
+
+    @staticmethod
+    def _company_params(rec, company_id=None):
+        """Mapeamento para os parâmetros :nomeados de COMPANY_INSERT_SQL/COMPANY_UPDATE_SQL."""
+        p = {c: rec[c] for c in DB.COMPANY_COLS}
+        p["active"] = int(rec["active"])
+        p["id"] = company_id
+        return p
 
     def company_save(self, rec, company_id=None):
+        params = self._company_params(rec, company_id)
         if company_id:
-            self.e(
-                """UPDATE companies
-                      SET cnpj=?, razao_social=?, contato1=?, contato2=?, rua=?, bairro=?, numero=?,
-                          cep=?, uf=?, cidade=?, email=?, active=?
-                    WHERE id=?""",
-                (
-                    rec["cnpj"],
-                    rec["razao_social"],
-                    rec["contato1"],
-                    rec["contato2"],
-                    rec["rua"],
-                    rec["bairro"],
-                    rec["numero"],
-                    rec["cep"],
-                    rec["uf"],
-                    rec["cidade"],
-                    rec["email"],
-                    int(rec["active"]),
-                    company_id,
-                ),
-            )
+            self.e(self.COMPANY_UPDATE_SQL, params)
             return company_id
+        return self.e(self.COMPANY_INSERT_SQL, params)
 
-        return self.e(
-            """INSERT INTO companies
-               (cnpj, razao_social, contato1, contato2, rua, bairro, numero, cep, uf, cidade, email, active)
-               VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (
-                rec["cnpj"],
-                rec["razao_social"],
-                rec["contato1"],
-                rec["contato2"],
-                rec["rua"],
-                rec["bairro"],
-                rec["numero"],
-                rec["cep"],
-                rec["uf"],
-                rec["cidade"],
-                rec["email"],
-                int(rec["active"]),
-            ),
-        )
+    def companies_bulk_save(self, items):
+        """
+        Salva várias empresas numa única transação.
+        items: lista de (company_id ou None, rec). Retorna os IDs na mesma ordem.
+        """
+        params = [self._company_params(rec, cid) for cid, rec in items]
+        return self._bulk_save(params, self.COMPANY_INSERT_SQL, self.COMPANY_UPDATE_SQL)
 
     def company_delete(self, company_id):
         self.e("DELETE FROM companies WHERE id=?", (company_id,))
 
     # ---------------------- USERS ----------------------
     def users_all(self):
-        return self.q("SELECT * FROM users ORDER BY name")
+        return self.q("SELECT *, strftime('%d/%m/%Y', created_at) AS created_br FROM users ORDER BY name")
 
-    def user_save(self, rec, user_id=None):
+    def user_save(self, rec, user_id=None, pw_record=None):
+        """
+        pw_record: (salt, hash, kdf, custo) já calculado por new_password_record, para
+        quem grava em transação não rodar o KDF com o banco travado.
+        """
         if user_id:
             self.e(
                 """UPDATE users
@@ -681,21 +1298,21 @@ class DB:
                     user_id,
                 ),
             )
+            self._forget_acl(user_id)
             return user_id
 
-        salt = os.urandom(16)
-        iters = 240_000
-        pw_hash = pbkdf2_hash(rec.get("password", "123456"), salt, iters)
+        salt, pw_hash, kdf, cost = pw_record or new_password_record(rec.get("password", "123456"))
         return self.e(
             """INSERT INTO users
-               (name, username, password_salt, password_hash, iterations, is_admin, active)
-               VALUES (?,?,?,?,?,?,?)""",
+               (name, username, password_salt, password_hash, iterations, kdf, is_admin, active)
+               VALUES (?,?,?,?,?,?,?,?)""",
             (
                 rec["name"],
                 rec["username"],
                 salt,
                 pw_hash,
-                iters,
+                cost,
+                kdf,
                 int(rec["is_admin"]),
                 int(rec["active"]),
             ),
@@ -703,111 +1320,120 @@ class DB:
 
     def user_delete(self, user_id):
         self.e("DELETE FROM users WHERE id=?", (user_id,))
+        self._forget_acl(user_id)
 
-    def user_set_password(self, user_id, password):
-        salt = os.urandom(16)
-        iters = 240_000
-        pw_hash = pbkdf2_hash(password, salt, iters)
+    def user_set_password(self, user_id, password, pw_record=None):
+        salt, pw_hash, kdf, cost = pw_record or new_password_record(password)
         self.e(
-            "UPDATE users SET password_salt=?, password_hash=?, iterations=? WHERE id=?",
-            (salt, pw_hash, iters, user_id),
+            "UPDATE users SET password_salt=?, password_hash=?, iterations=?, kdf=? WHERE id=?",
+            (salt, pw_hash, cost, kdf, user_id),
         )
 
     def permissions_all(self):
-        return self.q("SELECT * FROM permission_types ORDER BY id")
+        if self._perm_types is None:
+            self._perm_types = self.q("SELECT * FROM permission_types ORDER BY id")
+        return self._perm_types
+
     def allowed_codes(self, user_id: int, company_id: int | None = None):
         """
-        Retorna um set com os códigos de permissão habilitados para o usuário.
-        Se for admin, devolve todos os códigos.
+        Retorna um frozenset com os códigos de permissão habilitados para o usuário.
+        Se for admin, devolve todos os códigos. Fica em cache até o usuário ou suas
+        permissões serem regravados.
         company_id é ignorado aqui (acesso à empresa já foi validado no login).
         """
+        codes = self._perm_cache.get(user_id)
+        if codes is not None:
+            return codes
         if self.is_admin(user_id):
-            rows = self.q("SELECT code FROM permission_types")
-            return {r["code"] for r in rows}
+            rows = self.permissions_all()
+        else:
+            sql = """
+                SELECT pt.code
+                FROM user_permissions up
+                JOIN permission_types pt ON pt.id = up.perm_id
+                WHERE up.user_id = ? AND up.allowed = 1
+            """
+            rows = self.q(sql, (user_id,))
+        codes = self._perm_cache[user_id] = frozenset(r["code"] for r in rows)
+        return codes
 
-        sql = """
-            SELECT pt.code
-            FROM user_permissions up
-            JOIN permission_types pt ON pt.id = up.perm_id
-            WHERE up.user_id = ? AND up.allowed = 1
+    def apply_permission_diff(self, user_id, changes):
         """
-        rows = self.q(sql, (user_id,))
-        return {r["code"] for r in rows}
-
-    def user_perm_map(self, user_id):
-        rows = self.q(
-            "SELECT perm_id, allowed FROM user_permissions WHERE user_id=?", (user_id,)
-        )
-        return {r["perm_id"]: bool(r["allowed"]) for r in rows}
-
-    def set_user_permissions(self, user_id, allowed_perm_ids):
-        self.e("DELETE FROM user_permissions WHERE user_id=?", (user_id,))
-        for (pid,) in self.q("SELECT id FROM permission_types"):
-            allow = 1 if pid in allowed_perm_ids else 0
-            self.e(
-                "INSERT INTO user_permissions(user_id, perm_id, allowed) VALUES (?,?,?)",
-                (user_id, pid, allow),
+        Grava só as permissões que mudaram. changes: iterável de (perm_id, allowed).
+        Um executemany num só COMMIT (nenhum DELETE das demais linhas).
+        """
+        rows = [(user_id, pid, 1 if allowed else 0) for pid, allowed in changes]
+        if not rows:
+            return
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO user_permissions(user_id, perm_id, allowed) VALUES (?,?,?)", rows
             )
+        self._forget_acl(user_id)
 
-    def company_access_map(self, user_id):
-        rows = self.q(
-            "SELECT company_id FROM user_company_access WHERE user_id=?", (user_id,)
-        )
-        return {r["company_id"] for r in rows}
+    def user_access_all(self):
+        """Retorna {user_id: {company_id, ...}} para todos os usuários (uma única consulta)."""
+        res = {}
+        for r in self.q("SELECT user_id, company_id FROM user_company_access"):
+            res.setdefault(r["user_id"], set()).add(r["company_id"])
+        return res
 
-    def set_company_access(self, user_id, company_ids):
-        self.e("DELETE FROM user_company_access WHERE user_id=?", (user_id,))
-        for cid in company_ids:
-            self.e(
-                "INSERT INTO user_company_access(user_id, company_id) VALUES (?,?)",
-                (user_id, cid),
-            )
+    def user_permissions_all(self):
+        """Retorna {user_id: {perm_id: allowed}} para todos os usuários (uma única consulta)."""
+        res = {}
+        for r in self.q("SELECT user_id, perm_id, allowed FROM user_permissions"):
+            res.setdefault(r["user_id"], {})[r["perm_id"]] = bool(r["allowed"])
+        return res
+
+    def apply_access_diff(self, user_id, to_add, to_remove):
+        """Aplica só a diferença de acessos (DELETE/INSERT via executemany) num só COMMIT."""
+        if not to_add and not to_remove:
+            return
+        with self.transaction():
+            if to_remove:
+                self.conn.executemany(
+                    "DELETE FROM user_company_access WHERE user_id=? AND company_id=?",
+                    [(user_id, cid) for cid in to_remove],
+                )
+            if to_add:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO user_company_access(user_id, company_id) VALUES (?,?)",
+                    [(user_id, cid) for cid in to_add],
+                )
 
     # ---------------------- BANKS ----------------------
     def banks(self, company_id):
         return self.q(
-            "SELECT * FROM bank_accounts WHERE company_id=? ORDER BY bank_name, account_name",
+            "SELECT *, strftime('%d/%m/%Y', created_at) AS created_br FROM bank_accounts"
+            " WHERE company_id=? ORDER BY bank_name, account_name",
             (company_id,),
         )
 
+    @staticmethod
+    def _bank_params(company_id, rec, bank_id=None):
+        """Mapeamento para os parâmetros :nomeados de BANK_INSERT_SQL/BANK_UPDATE_SQL."""
+        p = {c: rec[c] for c in DB.BANK_COLS}
+        p["initial_balance"] = float(rec["initial_balance"])
+        p["current_balance"] = float(rec["current_balance"])
+        p["active"] = int(rec["active"])
+        p["company_id"] = company_id
+        p["id"] = bank_id
+        return p
+
     def bank_save(self, company_id, rec, bank_id=None):
+        params = self._bank_params(company_id, rec, bank_id)
         if bank_id:
-            self.e(
-                """UPDATE bank_accounts
-                      SET bank_name=?, account_name=?, account_type=?, agency=?, account_number=?,
-                          initial_balance=?, current_balance=?, active=?
-                    WHERE id=?""",
-                (
-                    rec["bank_name"],
-                    rec["account_name"],
-                    rec["account_type"],
-                    rec["agency"],
-                    rec["account_number"],
-                    float(rec["initial_balance"]),
-                    float(rec["current_balance"]),
-                    int(rec["active"]),
-                    bank_id,
-                ),
-            )
+            self.e(self.BANK_UPDATE_SQL, params)
             return bank_id
+        return self.e(self.BANK_INSERT_SQL, params)
 
-        return self.e(
-            """INSERT INTO bank_accounts
-               (company_id, bank_name, account_name, account_type, agency, account_number,
-                initial_balance, current_balance, active)
-               VALUES (?,?,?,?,?,?,?,?,?)""",
-            (
-                company_id,
-                rec["bank_name"],
-                rec["account_name"],
-                rec["account_type"],
-                rec["agency"],
-                rec["account_number"],
-                float(rec["initial_balance"]),
-                float(rec["current_balance"]),
-                int(rec["active"]),
-            ),
-        )
+    def banks_bulk_save(self, company_id, items):
+        """
+        Salva várias contas numa única transação.
+        items: lista de (bank_id ou None, rec). Retorna os IDs na mesma ordem.
+        """
+        params = [self._bank_params(company_id, rec, bid) for bid, rec in items]
+        return self._bulk_save(params, self.BANK_INSERT_SQL, self.BANK_UPDATE_SQL)
 
     def bank_delete(self, bank_id):
         self.e("DELETE FROM bank_accounts WHERE id=?", (bank_id,))
@@ -826,52 +1452,29 @@ class DB:
             (company_id,),
         )
 
+    @staticmethod
+    def _entity_params(company_id, rec, entity_id=None):
+        """Mapeamento para os parâmetros :nomeados de ENTITY_INSERT_SQL/ENTITY_UPDATE_SQL."""
+        p = {c: rec[c] for c in DB.ENTITY_COLS}
+        p["active"] = int(rec["active"])
+        p["company_id"] = company_id
+        p["id"] = entity_id
+        return p
+
     def entity_save(self, company_id, rec, entity_id=None):
+        params = self._entity_params(company_id, rec, entity_id)
         if entity_id:
-            self.e(
-                """UPDATE entities
-                      SET kind=?, cnpj_cpf=?, razao_social=?, contato1=?, contato2=?, rua=?, bairro=?, numero=?, cep=?, uf=?, cidade=?, email=?, active=?
-                    WHERE id=?""",
-                (
-                    rec["kind"],
-                    rec["cnpj_cpf"],
-                    rec["razao_social"],
-                    rec["contato1"],
-                    rec["contato2"],
-                    rec["rua"],
-                    rec["bairro"],
-                    rec["numero"],
-                    rec["cep"],
-                    rec["uf"],
-                    rec["cidade"],
-                    rec["email"],
-                    int(rec["active"]),
-                    entity_id,
-                ),
-            )
+            self.e(self.ENTITY_UPDATE_SQL, params)
             return entity_id
+        return self.e(self.ENTITY_INSERT_SQL, params)
 
-        return self.e(
-            """INSERT INTO entities
-               (company_id, kind, cnpj_cpf, razao_social, contato1, contato2, rua, bairro, numero, cep, uf, cidade, email, active)
-               VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (
-                company_id,
-                rec["kind"],
-                rec["cnpj_cpf"],
-                rec["razao_social"],
-                rec["contato1"],
-                rec["contato2"],
-                rec["rua"],
-                rec["bairro"],
-                rec["numero"],
-                rec["cep"],
-                rec["uf"],
-                rec["cidade"],
-                rec["email"],
-                int(rec["active"]),
-            ),
-        )
+    def entities_bulk_save(self, company_id, items):
+        """
+        Salva vários cadastros numa única transação.
+        items: lista de (entity_id ou None, rec). Retorna os IDs na mesma ordem.
+        """
+        params = [self._entity_params(company_id, rec, eid) for eid, rec in items]
+        return self._bulk_save(params, self.ENTITY_INSERT_SQL, self.ENTITY_UPDATE_SQL)
 
     def entity_delete(self, entity_id):
         self.e("DELETE FROM entities WHERE id=?", (entity_id,))
@@ -889,16 +1492,19 @@ class DB:
         )
 
     def category_save(self, company_id, name, tipo, cat_id=None):
+        params = dict(company_id=company_id, name=name, tipo=tipo, id=cat_id)
         if cat_id:
-            self.e(
-                "UPDATE categories SET name=?, tipo=? WHERE id=?",
-                (name, tipo, cat_id),
-            )
+            self.e(self.CATEGORY_UPDATE_SQL, params)
             return cat_id
-        return self.e(
-            "INSERT INTO categories(company_id,name,tipo) VALUES(?,?,?)",
-            (company_id, name, tipo),
-        )
+        return self.e(self.CATEGORY_INSERT_SQL, params)
+
+    def categories_bulk_save(self, company_id, items):
+        """
+        Salva várias categorias numa única transação (tudo ou nada).
+        items: lista de (cat_id ou None, name, tipo). Retorna os IDs na mesma ordem.
+        """
+        params = [dict(company_id=company_id, name=name, tipo=tipo, id=cid) for cid, name, tipo in items]
+        return self._bulk_save(params, self.CATEGORY_INSERT_SQL, self.CATEGORY_UPDATE_SQL)
 
     def category_delete(self, cat_id):
         self.e("DELETE FROM categories WHERE id=?", (cat_id,))
@@ -909,166 +1515,235 @@ class DB:
             (category_id,),
         )
 
+    def subcategories_for_company(self, company_id):
+        """Todas as subcategorias da empresa numa consulta (ordenadas por categoria, nome)."""
+        return self.q(
+            """SELECT s.* FROM subcategories s
+                 JOIN categories c ON c.id = s.category_id
+                WHERE c.company_id=?
+                ORDER BY s.category_id, s.name""",
+            (company_id,),
+        )
+
     def subcategory_save(self, category_id, name, sub_id=None):
+        params = dict(category_id=category_id, name=name, id=sub_id)
         if sub_id:
-            self.e(
-                "UPDATE subcategories SET name=?, category_id=? WHERE id=?",
-                (name, category_id, sub_id),
-            )
+            self.e(self.SUBCATEGORY_UPDATE_SQL, params)
             return sub_id
-        return self.e(
-            "INSERT INTO subcategories(category_id,name) VALUES(?,?)",
-            (category_id, name),
-        )
+        return self.e(self.SUBCATEGORY_INSERT_SQL, params)
+
+    def subcategories_bulk_save(self, category_id, items):
+        """
+        Salva várias subcategorias da categoria numa única transação (tudo ou nada).
+        items: lista de (sub_id ou None, name). Retorna os IDs na mesma ordem.
+        """
+        params = [dict(category_id=category_id, name=name, id=sid) for sid, name in items]
+        return self._bulk_save(params, self.SUBCATEGORY_INSERT_SQL, self.SUBCATEGORY_UPDATE_SQL)
 
     def subcategory_delete(self, sub_id):
         self.e("DELETE FROM subcategories WHERE id=?", (sub_id,))
 
     # ---------------------- TRANSACTIONS / PAYMENTS ----------------------
-    def transactions(self, company_id, tipo=None):
-        base = """
-            SELECT t.*,
-                   IFNULL((SELECT SUM(p.amount + p.interest - p.discount)
-                             FROM payments p
-                            WHERE p.transaction_id=t.id), 0) AS pago
-              FROM transactions t
-             WHERE t.company_id=?
+    # SQL da grade de lançamentos montado uma vez: cada refresh repete o mesmo
+    # texto e cai direto no cache de statements da conexão (sem novo prepare)
+    _SQL_LIST_TX = """
+        SELECT t.*,
+               IFNULL(e.razao_social, '') AS entity_name,
+               IFNULL(c.name, '')         AS category_name,
+               IFNULL(s.name, '')         AS subcategory_name,
+               CASE WHEN b.id IS NULL THEN ''
+                    ELSE b.bank_name||' - '||IFNULL(b.account_name,'') END AS bank_name,
+               IFNULL(pg.juros, 0) AS juros,
+               pg.ultima_data      AS ultima_data_pag
+          FROM transactions t
+          LEFT JOIN entities e      ON e.id = t.entity_id
+          LEFT JOIN categories c    ON c.id = t.category_id
+          LEFT JOIN subcategories s ON s.id = t.subcategory_id
+          LEFT JOIN bank_accounts b ON b.id = t.banco_id_padrao
+          LEFT JOIN (SELECT transaction_id,
+                            SUM(interest)                     AS juros,
+                            MAX(payment_date)                 AS ultima_data
+                       FROM payments
+                      WHERE company_id = ?
+                   GROUP BY transaction_id) pg ON pg.transaction_id = t.id
+         WHERE t.company_id=?
+    """
+    _SQL_LIST_TX_ALL = _SQL_LIST_TX + " ORDER BY t.data_venc"
+    _SQL_LIST_TX_TIPO = _SQL_LIST_TX + " AND t.tipo=? ORDER BY t.data_venc"
+
+    def transactions_with_names(self, company_id, tipo=None):
+        """
+        Lançamentos já com os nomes (entidade/categoria/subcategoria/banco) e o
+        resumo dos pagamentos (juros, última data) numa única consulta; o total
+        pago vem da coluna t.pago.
         """
-        params = [company_id]
         if tipo:
-            base += " AND t.tipo=?"
-            params.append(tipo)
-        base += " ORDER BY date(data_venc)"
-        return self.q(base, tuple(params))
+            return self.q(self._SQL_LIST_TX_TIPO, (company_id, company_id, tipo))
+        return self.q(self._SQL_LIST_TX_ALL, (company_id, company_id))
 
     def transaction_save(self, rec, tx_id=None):
+        params = dict(rec, parcelas_qtd=int(rec["parcelas_qtd"]), valor=float(rec["valor"]), id=tx_id)
         if tx_id:
-            sql = """
-                UPDATE transactions
-                   SET tipo=?, entity_id=?, category_id=?, subcategory_id=?, descricao=?,
-                       data_lanc=?, data_venc=?, forma_pagto=?, parcelas_qtd=?, valor=?,
-                       banco_id_padrao=?, updated_at=datetime('now')
-                 WHERE id=?
-            """
-            self.e(
-                sql,
-                (
-                    rec["tipo"],
-                    rec["entity_id"],
-                    rec["category_id"],
-                    rec["subcategory_id"],
-                    rec["descricao"],
-                    rec["data_lanc"],
-                    rec["data_venc"],
-                    rec["forma_pagto"],
-                    int(rec["parcelas_qtd"]),
-                    float(rec["valor"]),
-                    rec["banco_id_padrao"],
-                    tx_id,
-                ),
-            )
+            self.e(self.TRANSACTION_UPDATE_SQL, params)
             return tx_id
-
-        sql = """
-            INSERT INTO transactions
-                (company_id, tipo, entity_id, category_id, subcategory_id, descricao,
-                 data_lanc, data_venc, forma_pagto, parcelas_qtd, valor, status,
-                 banco_id_padrao, created_by)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,'EM_ABERTO',?,?)
-        """
-        return self.e(
-            sql,
-            (
-                rec["company_id"],
-                rec["tipo"],
-                rec["entity_id"],
-                rec["category_id"],
-                rec["subcategory_id"],
-                rec["descricao"],
-                rec["data_lanc"],
-                rec["data_venc"],
-                rec["forma_pagto"],
-                int(rec["parcelas_qtd"]),
-                float(rec["valor"]),
-                rec["banco_id_padrao"],
-                rec["created_by"],
-            ),
-        )
+        return self.e(self.TRANSACTION_INSERT_SQL, params)
 
     def transaction_delete(self, tx_id):
         self.e("DELETE FROM transactions WHERE id=?", (tx_id,))
 
+    _SQL_PAYMENTS_FOR = """
+        SELECT p.*, b.bank_name||' - '||IFNULL(b.account_name,'') AS banco
+          FROM payments p
+          JOIN bank_accounts b ON b.id = p.bank_id
+         WHERE p.transaction_id=?
+         ORDER BY p.payment_date
+    """
+
     def payments_for(self, tx_id):
-        sql = """
-            SELECT p.*, b.bank_name||' - '||IFNULL(b.account_name,'') AS banco
-              FROM payments p
-              JOIN bank_accounts b ON b.id = p.bank_id
-             WHERE p.transaction_id=?
-             ORDER BY date(p.payment_date)
-        """
-        return self.q(sql, (tx_id,))
+        return self.q(self._SQL_PAYMENTS_FOR, (tx_id,))
+
+    @staticmethod
+    def _payment_params(rec):
+        return dict(rec, amount=float(rec["amount"]), interest=float(rec["interest"]),
+                    discount=float(rec["discount"]))
 
     def payment_add(self, rec):
-        sql = """
-            INSERT INTO payments
-                (transaction_id, company_id, payment_date, bank_id, amount, interest, discount, doc_ref, created_by)
-            VALUES (?,?,?,?,?,?,?,?,?)
-        """
-        return self.e(
-            sql,
-            (
-                rec["transaction_id"],
-                rec["company_id"],
-                rec["payment_date"],
-                rec["bank_id"],
-                float(rec["amount"]),
-                float(rec["interest"]),
-                float(rec["discount"]),
-                rec["doc_ref"],
-                rec["created_by"],
-            ),
-        )
+        cur = self._stmt_payment_add
+        cur.execute(self.PAYMENT_INSERT_SQL, self._payment_params(rec))
+        if not self._in_tx:
+            self.conn.commit()
+        return cur.lastrowid
 
     def payment_delete(self, payment_id):
         self.e("DELETE FROM payments WHERE id=?", (payment_id,))
 
-    # ---------------------- DRE / DASHBOARD ----------------------
-    def dre(self, company_id, ano, mes=None, regime="COMPETENCIA"):
-        src = "vw_dre_competencia" if regime == "COMPETENCIA" else "vw_dre_caixa"
-        params = [company_id, str(ano)]
-        filt = ""
-        if mes:
-            filt = " AND mes=? "
-            params.append(f"{int(mes):02d}")
+    # ---------------------- FLUXO DE CAIXA ----------------------
+    @staticmethod
+    def _cashflow_params(company_id, dt_ini, dt_fim, bank_id):
+        if bank_id:
+            return (company_id, dt_ini, dt_fim, bank_id)
+        return (company_id, dt_ini, dt_fim)
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _cashflow_sql(kind: str, with_bank: bool) -> str:
+        """
+        SQL do fluxo montado uma vez por formato (linhas, página ou resumo; com ou
+        sem banco): o mesmo objeto str a cada chamada, sempre achado no cache de
+        statements. Pagamentos de lançamentos LIQUIDADOS no período, positivos
+        para RECEBER e negativos para PAGAR.
+        """
+        # datas gravadas em ISO (yyyy-mm-dd): compara a coluna crua, sem date()
+        # por linha, para o SQLite usar o índice (company_id, payment_date)
+        where = """
+             WHERE p.company_id = ?
+               AND p.payment_date >= ? AND p.payment_date < date(?, '+1 day')
+               AND t.status = 'LIQUIDADO'
+        """
+        if with_bank:
+            where += " AND p.bank_id = ?"
+        if kind == "resumo":
+            return f"""
+            SELECT COUNT(*) AS n,
+                   IFNULL(SUM(CASE WHEN t.tipo='RECEBER'
+                                   THEN (p.amount + p.interest - p.discount)
+                                   ELSE -(p.amount + p.interest - p.discount) END), 0) AS total
+              FROM payments p
+              JOIN transactions t ON t.id = p.transaction_id
+            {where}
+        """
         sql = f"""
-            SELECT c.name AS categoria, v.tipo, v.total
+            SELECT
+                CASE WHEN t.tipo='RECEBER'
+                     THEN (p.amount + p.interest - p.discount)
+                     ELSE -(p.amount + p.interest - p.discount)
+                END AS valor,
+                t.tipo AS tipo,
+                p.payment_date AS data_liq,
+                IFNULL(e.razao_social,'') AS entidade,
+                IFNULL(c.name,'') AS categoria,
+                IFNULL(s.name,'') AS subcategoria
+            FROM payments p
+            JOIN transactions t     ON t.id = p.transaction_id
+            LEFT JOIN entities e     ON e.id = t.entity_id
+            LEFT JOIN categories c   ON c.id = t.category_id
+            LEFT JOIN subcategories s ON s.id = t.subcategory_id
+            {where}
+            ORDER BY p.payment_date, p.id
+        """
+        if kind == "page":
+            sql += " LIMIT ? OFFSET ?"
+        return sql
+
+    def cashflow(self, company_id, dt_ini, dt_fim, bank_id=None, limit=-1, offset=0):
+        """Uma página do fluxo (limit=-1: sem limite)."""
+        params = self._cashflow_params(company_id, dt_ini, dt_fim, bank_id)
+        return self.q(self._cashflow_sql("page", bool(bank_id)), (*params, limit, offset))
+
+    def cashflow_iter(self, company_id, dt_ini, dt_fim, bank_id=None):
+        """Cursor sobre o fluxo completo: exportações leem linha a linha, sem materializar."""
+        params = self._cashflow_params(company_id, dt_ini, dt_fim, bank_id)
+        return self.conn.execute(self._cashflow_sql("rows", bool(bank_id)), params)
+
+    def cashflow_resumo(self, company_id, dt_ini, dt_fim, bank_id=None):
+        """(quantidade de linhas, total com sinal) do período inteiro, independente da página."""
+        params = self._cashflow_params(company_id, dt_ini, dt_fim, bank_id)
+        r = self.q(self._cashflow_sql("resumo", bool(bank_id)), params)[0]
+        return int(r["n"]), float(r["total"] or 0.0)
+
+    # ---------------------- DRE / DASHBOARD ----------------------
+    @staticmethod
+    def _build_dre_sql():
+        """
+        SQL do DRE especializado por (regime, com mês?) — montado uma vez só.
+        Os totais de RECEBER e de PAGAR (sem DESPESAS COM IMPOSTOS, que entram
+        como retenções) vêm repetidos em cada linha via janela OVER ().
+        """
+        variants = {}
+        for regime, src in (("COMPETENCIA", "vw_dre_competencia"), ("CAIXA", "vw_dre_caixa")):
+            for with_mes in (True, False):
+                filt = " AND mes=? " if with_mes else ""
+                variants[(regime, with_mes)] = f"""
+            SELECT c.name AS categoria, v.tipo, v.total,
+                   SUM(CASE WHEN v.tipo = 'RECEBER' THEN v.total ELSE 0 END) OVER () AS total_receber,
+                   SUM(CASE WHEN v.tipo = 'PAGAR' AND UPPER(c.name) <> 'DESPESAS COM IMPOSTOS'
+                            THEN v.total ELSE 0 END) OVER () AS total_pagar
               FROM {src} v
               JOIN categories c ON c.id = v.category_id
              WHERE v.company_id = ? AND v.ano = ? {filt}
              ORDER BY v.tipo, c.name
         """
-        return self.q(sql, tuple(params))
+        return variants
+
+    def dre(self, company_id, ano, mes=None, regime="COMPETENCIA"):
+        regime = "COMPETENCIA" if regime == "COMPETENCIA" else "CAIXA"
+        if mes:
+            return self.q(self._dre_sql[(regime, True)], (company_id, str(ano), f"{int(mes):02d}"))
+        return self.q(self._dre_sql[(regime, False)], (company_id, str(ano)))
 
     def resumo_periodo(self, company_id, dt_ini: str, dt_fim_excl: str):
+        # uma linha com os dois saldos (CASE por tipo) em vez de GROUP BY tipo
         sql = """
-            SELECT t.tipo,
-                   ROUND(SUM(t.valor - IFNULL((
-                       SELECT SUM(p.amount + p.interest - p.discount)
-                         FROM payments p
-                        WHERE p.transaction_id=t.id
-                   ),0)), 2) AS saldo
+            SELECT ROUND(SUM(CASE WHEN t.tipo='PAGAR'   THEN t.valor - t.pago ELSE 0 END), 2) AS pagar,
+                   ROUND(SUM(CASE WHEN t.tipo='RECEBER' THEN t.valor - t.pago ELSE 0 END), 2) AS receber
               FROM transactions t
-             WHERE t.company_id=? 
-               AND date(t.data_venc) >= date(?) 
-               AND date(t.data_venc) <  date(?)
+             WHERE t.company_id=?
+               AND t.data_venc >= ?
+               AND t.data_venc <  ?
                AND t.status <> 'CANCELADO'
-          GROUP BY t.tipo
         """
-        rows = self.q(sql, (company_id, dt_ini, dt_fim_excl))
-        res = {"PAGAR": 0.0, "RECEBER": 0.0}
-        for r in rows:
-            res[r["tipo"]] = max(0.0, float(r["saldo"] or 0.0))
-        return res
+        pagar, receber = self.q(sql, (company_id, dt_ini, dt_fim_excl))[0]
+        return {"PAGAR": max(0.0, float(pagar or 0.0)), "RECEBER": max(0.0, float(receber or 0.0))}
+
+    @staticmethod
+    def _periodo_iso(ano, mes=None):
+        """(início, fim exclusivo) em ISO do ano ou do mês: filtro por faixa usa o índice da data."""
+        ano = int(ano)
+        if not mes:
+            return f"{ano:04d}-01-01", f"{ano + 1:04d}-01-01"
+        mes = int(mes)
+        fim = f"{ano + 1:04d}-01-01" if mes == 12 else f"{ano:04d}-{mes + 1:02d}-01"
+        return f"{ano:04d}-{mes:02d}-01", fim
 
     def dre_retencoes_por_sub(self, company_id: int, ano: int, mes: int | None, regime: str = "COMPETENCIA"):
         """Retorna dict {'COFINS': v, 'CSLL': v, 'IRPJ': v, 'PIS': v} conforme período/regime."""
@@ -1085,13 +1760,11 @@ class DB:
                    AND t.tipo = 'PAGAR'
                    AND c.name = 'DESPESAS COM IMPOSTOS'
                    AND t.status <> 'CANCELADO'
-                   AND strftime('%Y', t.data_lanc) = ?
-                   AND (? IS NULL OR strftime('%m', t.data_lanc) = ?)
+                   AND t.data_lanc >= ? AND t.data_lanc < ?
                    AND s.name IN ('COFINS','CSLL','IRPJ','PIS')
               GROUP BY s.name
             """
-            mes_str = f"{int(mes):02d}" if mes else None
-            rows = self.q(sql, (company_id, str(ano), mes_str, mes_str))
+            rows = self.q(sql, (company_id, *self._periodo_iso(ano, mes)))
         else:  # CAIXA
             sql = """
                 SELECT s.name AS sub,
@@ -1103,110 +1776,211 @@ class DB:
                  WHERE p.company_id = ?
                    AND t.tipo = 'PAGAR'
                    AND c.name = 'DESPESAS COM IMPOSTOS'
-                   AND strftime('%Y', p.payment_date) = ?
-                   AND (? IS NULL OR strftime('%m', p.payment_date) = ?)
+                   AND p.payment_date >= ? AND p.payment_date < ?
                    AND s.name IN ('COFINS','CSLL','IRPJ','PIS')
               GROUP BY s.name
             """
-            mes_str = f"{int(mes):02d}" if mes else None
-            rows = self.q(sql, (company_id, str(ano), mes_str, mes_str))
+            rows = self.q(sql, (company_id, *self._periodo_iso(ano, mes)))
 
         for r in rows:
             if r["sub"] in ret:
                 ret[r["sub"]] = float(r["total"] or 0.0)
         return ret
-def table_to_html(table, title: str) -> str:
-    head = "<tr>" + "".join(
-        f"<th>{table.horizontalHeaderItem(c).text()}</th>"
-        for c in range(table.columnCount())
-    ) + "</tr>"
-    rows = []
-    for r in range(table.rowCount()):
-        tds = []
-        for c in range(table.columnCount()):
-            it = table.item(r, c)
-            tds.append(f"<td>{'' if it is None else it.text()}</td>")
-        rows.append("<tr>" + "".join(tds) + "</tr>")
-    style = """
-    <style>
-      body{font-family:Arial,Helvetica,sans-serif;font-size:12px}
-      h2{margin:0 0 8px 0}
-      table{border-collapse:collapse;width:100%}
-      th,td{border:1px solid #888;padding:4px 6px}
-      th{background:#eee}
-    </style>
-    """
-    return f"<!doctype html><html><head>{style}</head><body><h2>{title}</h2><table>{head}{''.join(rows)}</table></body></html>"
+def today_br_utc() -> str:
+    """Data de hoje como o SQLite grava em created_at (datetime('now'), UTC), em dd/mm/aaaa."""
+    return time.strftime("%d/%m/%Y", time.gmtime())
 
-def export_pdf_from_table(parent, table, title: str):
+_pdf_printer = None
+_pdf_doc = None
+
+def _get_pdf_printer() -> QPrinter:
+    """
+    Impressora do PDF do DRE (thread da UI, página ~800x800 px a 96 dpi).
+    QPrinter(HighResolution) é caro de construir (sonda impressoras): cria uma vez só.
+    """
+    global _pdf_printer
+    if _pdf_printer is None:
+        _pdf_printer = QPrinter(QPrinter.HighResolution)
+        _pdf_printer.setOutputFormat(QPrinter.PdfFormat)
+        _pdf_printer.setPageSizeMM(QSizeF(211.67, 211.67))
+    return _pdf_printer
+
+def _get_pdf_document(html: str) -> QTextDocument:
+    global _pdf_doc
+    if _pdf_doc is None:
+        _pdf_doc = QTextDocument()
+    _pdf_doc.setHtml(html)
+    return _pdf_doc
+
+def rows_to_document(headers, rows, title: str) -> QTextDocument:
+    """
+    Título e tabela (cabeçalho cinza, bordas finas), montados direto com
+    QTextCursor/QTextTable: sem gerar e reinterpretar HTML a cada exportação.
+    """
+    rows = rows if isinstance(rows, list) else list(rows)  # a tabela nasce com o total de linhas
+    doc = QTextDocument()
+    doc.setDefaultFont(QFont("Arial", 9))
+    cur = QTextCursor(doc)
+    tf = QTextCharFormat(); tf.setFontPointSize(13.5); tf.setFontWeight(QFont.Bold)
+    cur.insertText(title, tf)
+    cur.insertBlock()
+
+    fmt = QTextTableFormat()
+    fmt.setBorder(1); fmt.setBorderBrush(QColor("#888"))
+    fmt.setCellSpacing(0); fmt.setCellPadding(4)
+    fmt.setWidth(QTextLength(QTextLength.PercentageLength, 100))
+    fmt.setHeaderRowCount(1)
+    tbl = cur.insertTable(len(rows) + 1, len(headers), fmt)
+
+    th = QTextCharFormat(); th.setFontWeight(QFont.Bold)
+    for c, h in enumerate(headers):
+        cell = tbl.cellAt(0, c)
+        cf = cell.format(); cf.setBackground(QColor("#eee")); cell.setFormat(cf)
+        cell.firstCursorPosition().insertText(str(h), th)
+
+    # o cursor de inserção anda célula a célula (NextCell), sem cellAt por célula
+    cur = tbl.cellAt(1, 0).firstCursorPosition() if rows else cur
+    for row in rows:
+        for v in row:
+            cur.insertText(str(v))
+            cur.movePosition(QTextCursor.NextCell)
+    return doc
+
+# Exportações: as linhas são lidas na thread da UI (widgets e a conexão principal
+# só podem ser usados nela); montar e gravar o arquivo vai para o QThreadPool.
+def _write_pdf(fn, headers, rows, title):
+    doc = rows_to_document(headers, rows, title)
+    # impressora própria da tarefa: a de _get_pdf_printer é da thread da UI
+    pr = QPrinter(QPrinter.HighResolution)
+    pr.setOutputFormat(QPrinter.PdfFormat)
+    pr.setOutputFileName(fn)
+    doc.print_(pr)
+    return fn
+
+def _write_xlsx(fn, headers, rows):
+    import xlsxwriter
+    # constant_memory: cada linha vai para o disco ao passar para a próxima
+    # (exige escrita em ordem de linha, que é o caso aqui)
+    wb = xlsxwriter.Workbook(fn, {
+        "constant_memory": True, "strings_to_urls": False, "strings_to_numbers": False,
+    })
+    ws = wb.add_worksheet("Dados")
+    # cabeçalho
+    ws.write_row(0, 0, headers)
+    # linhas
+    for r, row in enumerate(rows, 1):
+        ws.write_row(r, 0, row)
+    wb.close()
+    return fn
+
+def _write_csv(fn, headers, rows):
+    with open(fn, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+        wr = csv.writer(f, delimiter=';')
+        wr.writerow(headers)
+        wr.writerows(rows)
+    return fn
+
+def export_pdf_rows(parent, headers, rows_fn, title: str):
+    """rows_fn() devolve um iterável de linhas (texto); pode ser um cursor do banco."""
     from PyQt5.QtWidgets import QFileDialog, QMessageBox
     fn, _ = QFileDialog.getSaveFileName(parent, "Salvar PDF", f"{title}.pdf", "PDF (*.pdf)")
     if not fn:
         return
     if not fn.lower().endswith(".pdf"):
         fn += ".pdf"
-    html = table_to_html(table, title)
-    doc = QTextDocument()
-    doc.setHtml(html)
-    pr = QPrinter(QPrinter.HighResolution)
-    pr.setOutputFormat(QPrinter.PdfFormat)
-    pr.setOutputFileName(fn)
-    doc.print_(pr)
-    QMessageBox.information(parent, "ERP Financeiro", f"PDF gerado em:\n{fn}")
+    def done(res):
+        if isinstance(res, Exception):
+            msg_err(f"Falha ao gerar o PDF:\n{res}", parent)
+        else:
+            QMessageBox.information(parent, "ERP Financeiro", f"PDF gerado em:\n{res}")
+    start_task(_write_pdf, fn, list(headers), list(rows_fn()), title, on_done=done)
 
-def export_excel_from_table(parent, table, title: str):
+def export_excel_rows(parent, headers, rows_fn, title: str):
+    """
+    rows_fn() devolve um iterável de linhas (texto); é lida uma vez só (pode ser
+    um cursor/gerador de uso único) e a mesma lista serve ao fallback CSV.
+    """
     from PyQt5.QtWidgets import QFileDialog, QMessageBox
-    try:
-        import xlsxwriter
-        fn, _ = QFileDialog.getSaveFileName(parent, "Salvar Excel", f"{title}.xlsx", "Excel (*.xlsx)")
-        if not fn:
-            return
-        if not fn.lower().endswith(".xlsx"):
-            fn += ".xlsx"
-        wb = xlsxwriter.Workbook(fn)
-        ws = wb.add_worksheet("Dados")
-        # cabeçalho
-        for c in range(table.columnCount()):
-            ws.write(0, c, table.horizontalHeaderItem(c).text())
-        # linhas
-        for r in range(table.rowCount()):
-            for c in range(table.columnCount()):
-                it = table.item(r, c)
-                ws.write(r + 1, c, "" if it is None else it.text())
-        wb.close()
-        QMessageBox.information(parent, "ERP Financeiro", f"Planilha Excel gerada em:\n{fn}")
-    except Exception:
-        # fallback CSV
-        fn, _ = QFileDialog.getSaveFileName(parent, "Salvar CSV", f"{title}.csv", "CSV (*.csv)")
-        if not fn:
-            return
-        if not fn.lower().endswith(".csv"):
-            fn += ".csv"
-        with open(fn, "w", newline="", encoding="utf-8") as f:
-            wr = csv.writer(f, delimiter=';')
-            wr.writerow([table.horizontalHeaderItem(c).text() for c in range(table.columnCount())])
-            for r in range(table.rowCount()):
-                wr.writerow([(table.item(r, c).text() if table.item(r, c) else "") for c in range(table.columnCount())])
-        QMessageBox.information(parent, "ERP Financeiro", f"CSV gerado em:\n{fn}")
+    headers = list(headers)
+    # só verifica se o pacote existe; o import de fato fica em _write_xlsx (no pool)
+    if importlib.util.find_spec("xlsxwriter") is None:
+        return _export_csv(parent, headers, list(rows_fn()), title)
+    fn, _ = QFileDialog.getSaveFileName(parent, "Salvar Excel", f"{title}.xlsx", "Excel (*.xlsx)")
+    if not fn:
+        return
+    if not fn.lower().endswith(".xlsx"):
+        fn += ".xlsx"
+    rows = list(rows_fn())
+    def done(res):
+        if isinstance(res, Exception):
+            msg_err(f"Falha ao gerar a planilha Excel:\n{res}\n\nSerá oferecido salvar em CSV.", parent)
+            _export_csv(parent, headers, rows, title)  # fallback CSV
+        else:
+            QMessageBox.information(parent, "ERP Financeiro", f"Planilha Excel gerada em:\n{res}")
+    start_task(_write_xlsx, fn, headers, rows, on_done=done)
+
+def _export_csv(parent, headers, rows, title: str):
+    from PyQt5.QtWidgets import QFileDialog, QMessageBox
+    fn, _ = QFileDialog.getSaveFileName(parent, "Salvar CSV", f"{title}.csv", "CSV (*.csv)")
+    if not fn:
+        return
+    if not fn.lower().endswith(".csv"):
+        fn += ".csv"
+    def done(res):
+        if isinstance(res, Exception):
+            msg_err(f"Falha ao gerar o CSV:\n{res}", parent)
+        else:
+            QMessageBox.information(parent, "ERP Financeiro", f"CSV gerado em:\n{res}")
+    start_task(_write_csv, fn, headers, rows, on_done=done)
+
 # =============================================================================
 # Diálogos base
 # =============================================================================
 class AdminAuthDialog(QDialog):
+    # (username, salt) -> (HMAC(_SESSION_KEY, salt+senha), instante); evita refazer o KDF em
+    # confirmações repetidas dentro da sessão
+    SESSION_KDF_CACHE: dict = {}
+    SESSION_KDF_TTL = 600  # segundos
+    # chave aleatória do processo: o digest em cache é um HMAC que só vale nesta
+    # execução (um sha256 puro desfaria o custo do KDF para quem lesse a memória)
+    _SESSION_KEY = os.urandom(32)
+
     def __init__(self, db: DB, parent=None):
         super().__init__(parent); self.db=db
         self.setWindowTitle("Autenticação de Administrador")
         form = QFormLayout(self)
         self.edUser = QLineEdit(); self.edPass = QLineEdit(); self.edPass.setEchoMode(QLineEdit.Password)
         form.addRow("Usuário:", self.edUser); form.addRow("Senha:", self.edPass)
-        bt = QPushButton("Validar"); bt.setIcon(std_icon(self, self.style().SP_DialogApplyButton)); bt.clicked.connect(self.validate)
-        form.addRow(bt); self.ok=False; self.user=None
+        self.btValidar = bt = QPushButton("Validar"); bt.setIcon(std_icon(self, self.style().SP_DialogApplyButton)); bt.clicked.connect(self.validate)
+        form.addRow(bt); self.ok=False; self.user=None; self._kdf_job=None
         enable_autosize(self, 0.35, 0.3, 420, 260)
+
+    @staticmethod
+    def _session_digest(salt: bytes, password: str) -> bytes:
+        return hmac.new(AdminAuthDialog._SESSION_KEY, bytes(salt) + password.encode("utf-8"),
+                        hashlib.sha256).digest()
+
     def validate(self):
-        rows = self.db.q("SELECT * FROM users WHERE username=? AND active=1", (self.edUser.text().strip(),))
-        if not rows: msg_err("Usuário inválido.", self); return
-        u = rows[0]
-        calc = hashlib.pbkdf2_hmac("sha256", self.edPass.text().encode("utf-8"), u["password_salt"], u["iterations"])
+        u = self.db.login_user(self.edUser.text().strip())
+        if u is None: msg_err("Usuário inválido.", self); return
+        password = self.edPass.text()
+        key = (u["username"], bytes(u["password_salt"]))
+        hit = self.SESSION_KDF_CACHE.get(key)
+        if hit and time.monotonic() - hit[1] < self.SESSION_KDF_TTL \
+                and secure_eq(hit[0], self._session_digest(u["password_salt"], password)):
+            self.handle_result(u, password, u["password_hash"]); return
+        # KDF (scrypt/PBKDF2) fora da thread da UI
+        self.btValidar.setEnabled(False)
+        self._kdf_job = KdfRunnable(password, u["password_salt"], u["kdf"], u["iterations"])
+        self._kdf_job.signals.done.connect(lambda calc, _rec, u=u, pw=password: self.handle_result(u, pw, calc))
+        QThreadPool.globalInstance().start(self._kdf_job)
+
+    def handle_result(self, u, password, calc):
+        self._kdf_job = None
+        self.btValidar.setEnabled(True)
         if not secure_eq(calc, u["password_hash"]): msg_err("Senha incorreta.", self); return
+        self.SESSION_KDF_CACHE[(u["username"], bytes(u["password_salt"]))] = (
+            self._session_digest(u["password_salt"], password), time.monotonic())
         if not u["is_admin"]: msg_err("Usuário não é administrador.", self); return
         self.ok=True; self.user=u; self.accept()
 
@@ -1214,15 +1988,20 @@ class AdminAuthDialog(QDialog):
 # Cadastros
 # =============================================================================
 class CompaniesDialog(QDialog):
+    RO_COLS = frozenset({0, 13})  # ID e "Criado em" não editáveis
+    HEADERS = ["ID","CNPJ","Razão Social","Contato 1","Contato 2",
+               "Rua","Bairro","Nº","CEP","UF","Cidade","Email","Ativo","Criado em"]
+    PAGE = 500  # linhas por leitura; as seguintes vêm conforme a rolagem (fetchMore)
+
     def __init__(self, db: DB, parent=None):
         super().__init__(parent); self.db=db
         self.setWindowTitle("Cadastro de Empresas")
 
-        self.table=QTableWidget(0,14)
-        self.table.setHorizontalHeaderLabels([
-            "ID","CNPJ","Razão Social","Contato 1","Contato 2",
-            "Rua","Bairro","Nº","CEP","UF","Cidade","Email","Ativo","Criado em"
-        ])
+        # grade sobre modelo: só as células visíveis são lidas
+        self.table=QTableView()
+        self.model=EditableRowsModel(self.HEADERS, self.RO_COLS, parent=self)
+        self.table.setModel(self.model)
+        self.table.verticalHeader().setVisible(False)
         stretch_table(self.table); zebra_table(self.table)
 
         # Oculta ID
@@ -1252,89 +2031,122 @@ class CompaniesDialog(QDialog):
         hl=QHBoxLayout(); [hl.addWidget(b) for b in (btAdd,btSave,btDel,btReload)]
         lay.addLayout(hl)
 
+        self._query_seq = 0; self._query_job = None
         self.load()
         enable_autosize(self, 0.85, 0.75, 1100, 650)
 
     def load(self):
-        rows = self.db.companies_all()
-        self.table.setRowCount(0)
-        for r in rows:
-            row=self.table.rowCount(); self.table.insertRow(row)
-
-            cnpj = format_cnpj(r["cnpj"] or "")
-            cep  = r["cep"] or ""
-            if cep:
-                dcep = only_digits(cep)
-                cep  = f"{dcep[:5]}-{dcep[5:]}" if len(dcep)==8 else cep
+        # consulta no pool; _query_seq descarta respostas de recargas anteriores
+        self._query_seq += 1
+        seq = self._query_seq
+        self._query_job = start_query(
+            self.db, DB.companies_page, None, self.PAGE, on_done=lambda rows, seq=seq: self._populate(seq, rows)
+        )
 
-            data=[r["id"], cnpj, r["razao_social"], r["contato1"], r["contato2"],
-                  r["rua"], r["bairro"], r["numero"], cep, (r["uf"] or ""),
-                  r["cidade"], r["email"], r["active"], iso_to_br(str(r["created_at"])[:10])]
+    def _populate(self, seq, rows):
+        if seq != self._query_seq:
+            return
+        self._query_job = None
+        if isinstance(rows, Exception):
+            msg_err(str(rows), self)
+            return
+        # primeira página num único reset; página cheia indica que pode haver mais
+        self._after = (rows[-1]["razao_social"], rows[-1]["id"]) if rows else None
+        self.model.set_rows(self._display(rows), self._fetch_page if len(rows) == self.PAGE else None)
 
-            for c,val in enumerate(data):
-                it=QTableWidgetItem("" if val is None else str(val))
-                if c in (0,13):  # ID e "Criado em" não editáveis
-                    it.setFlags(it.flags() & ~Qt.ItemIsEditable)
-                self.table.setItem(row,c,it)
+    def _fetch_page(self):
+        rows = self.db.companies_page(self._after, self.PAGE)
+        if rows:
+            self._after = (rows[-1]["razao_social"], rows[-1]["id"])
+        return self._display(rows), len(rows) == self.PAGE
+
+    @staticmethod
+    def _display(rows):
+        """Linhas prontas para exibição."""
+        return [
+            (r["id"], format_cnpj(r["cnpj"] or ""), r["razao_social"], r["contato1"], r["contato2"],
+             r["rua"], r["bairro"], r["numero"], format_cep(r["cep"]), (r["uf"] or ""),
+             r["cidade"], r["email"], r["active"], (r["created_br"] or ""))
+            for r in rows
+        ]
 
     def add(self):
-        r=self.table.rowCount(); self.table.insertRow(r)
-        self.table.setItem(r,0,QTableWidgetItem(""))
-        self.table.setItem(r,12,QTableWidgetItem("1"))  # Ativo=1
+        self.model.fetch_all()  # linha nova vai depois da última página
+        row = [""] * len(self.HEADERS)
+        row[12] = "1"  # Ativo=1
+        self.table.setCurrentIndex(self.model.index(self.model.append_row(row), 1))
 
     def save(self):
-        for r in range(self.table.rowCount()):
-            id_txt = self.table.item(r,0).text() if self.table.item(r,0) else ""
+        # valida as linhas novas/alteradas antes; grava tudo de uma vez no final.
+        # páginas restantes lidas antes de gravar: a chave de paginação não muda por baixo
+        m = self.model; m.fetch_all(); txt = m.text
+        items, rows_idx = [], []
+        for r in range(m.rowCount()):
+            id_txt = txt(r,0)
+            if id_txt.strip().isdigit() and r not in m.dirty:
+                continue  # linha sem edição: nada a gravar
 
             # --- CNPJ: aceitar qualquer CNPJ com 14 dígitos (sem checar DV) ---
-            cnpj_masked = self.table.item(r,1).text() if self.table.item(r,1) else ""
-            cnpj = only_digits(cnpj_masked)
+            cnpj = only_digits(txt(r,1))
             if cnpj and len(cnpj) != 14:
                 msg_err(f"CNPJ deve ter 14 dígitos (linha {r+1}).")
                 return
 
             # CEP e UF continuam com validação básica
-            cep = self.table.item(r,8).text() if self.table.item(r,8) else ""
+            cep = txt(r,8)
             if cep and not validate_cep(cep):
                 msg_err(f"CEP inválido (linha {r+1}).")
                 return
-            uf = self.table.item(r,9).text().upper() if self.table.item(r,9) else ""
+            uf = txt(r,9).upper()
             if uf and not validate_uf(uf):
                 msg_err(f"UF inválida (linha {r+1}).")
                 return
 
             rec = dict(
                 cnpj=cnpj,
-                razao_social=self.table.item(r,2).text() if self.table.item(r,2) else "",
-                contato1=self.table.item(r,3).text() if self.table.item(r,3) else "",
-                contato2=self.table.item(r,4).text() if self.table.item(r,4) else "",
-                rua=self.table.item(r,5).text() if self.table.item(r,5) else "",
-                bairro=self.table.item(r,6).text() if self.table.item(r,6) else "",
-                numero=self.table.item(r,7).text() if self.table.item(r,7) else "",
+                razao_social=txt(r,2),
+                contato1=txt(r,3),
+                contato2=txt(r,4),
+                rua=txt(r,5),
+                bairro=txt(r,6),
+                numero=txt(r,7),
                 cep=only_digits(cep),
                 uf=uf,
-                cidade=self.table.item(r,10).text() if self.table.item(r,10) else "",
-                email=self.table.item(r,11).text() if self.table.item(r,11) else "",
-                active=1 if (self.table.item(r,12) and self.table.item(r,12).text() not in ("0","False","false")) else 0
+                cidade=txt(r,10),
+                email=txt(r,11),
+                active=0 if txt(r,12) in ("0","False","false") else 1
             )
             if not rec["razao_social"]:
                 msg_err("Razão Social é obrigatória.")
                 return
 
             cid = int(id_txt) if id_txt.strip().isdigit() else None
-            cid = self.db.company_save(rec, cid)
-            self.table.setItem(r,0,QTableWidgetItem(str(cid)))
+            items.append((cid, rec)); rows_idx.append(r)
+
+        try:
+            ids = self.db.companies_bulk_save(items)
+        except sqlite3.IntegrityError as e:
+            # transação já desfeita: nenhuma linha foi gravada, a grade fica como está
+            msg_err(f"Não foi possível salvar as empresas.\n{e}"); return
+
+        # sem recarregar a grade: só ID/formatação das linhas gravadas são ajustados
+        today = today_br_utc()
+        for r, (old_id, rec), cid in zip(rows_idx, items, ids):
+            m.set_text(r, 0, str(cid))
+            m.set_text(r, 1, format_cnpj(rec["cnpj"])); m.set_text(r, 8, format_cep(rec["cep"]))
+            m.set_text(r, 9, rec["uf"]); m.set_text(r, 12, str(rec["active"]))
+            if old_id is None: m.set_text(r, 13, today)
+        m.dirty.clear()
 
         msg_info("Empresas salvas.")
-        self.load()
 
     def delete(self):
-        r=self.table.currentRow()
+        r=self.table.currentIndex().row()
         if r < 0:
             return
-        id_txt = self.table.item(r,0).text() if self.table.item(r,0) else ""
+        id_txt = self.model.text(r,0)
         if not id_txt.strip().isdigit():
-            self.table.removeRow(r); return
+            self.model.remove_row(r); return
 
         # exige admin
         auth = AdminAuthDialog(self.db, self)
@@ -1350,16 +2162,24 @@ class CompaniesDialog(QDialog):
         self.load()
 
 class UsersDialog(QDialog):
+    RO_COLS = frozenset({0, 5})  # ID e "Criado em"
+
     def __init__(self, db: DB, parent=None):
         super().__init__(parent); self.db=db
         self.setWindowTitle("Cadastro de Usuários")
-        # tabela usuários
-        self.table=QTableWidget(0,6)
-        self.table.setHorizontalHeaderLabels(["ID","Nome","Usuário","Admin","Ativo","Criado em"])
+        # tabela usuários (modelo: só as células visíveis são lidas)
+        self.table=QTableView()
+        self.model=EditableRowsModel(["ID","Nome","Usuário","Admin","Ativo","Criado em"], self.RO_COLS, parent=self)
+        self.table.setModel(self.model)
+        self.table.verticalHeader().setVisible(False)
         stretch_table(self.table); zebra_table(self.table)
         self.table.setColumnHidden(0, True)
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
-        self.table.currentCellChanged.connect(self.load_right_panel)
+        # navegação rápida (setas/PgDn) reagenda o painel; só a última linha é aplicada
+        self._loading=False
+        self._panel_timer=QTimer(self); self._panel_timer.setSingleShot(True); self._panel_timer.setInterval(100)
+        self._panel_timer.timeout.connect(self.load_right_panel)
+        self.table.selectionModel().currentRowChanged.connect(self._schedule_right_panel)
 
         # painel direito: acessos e permissões
         self.grpAccess=QGroupBox("Acesso a Empresas"); self.listAccess=QListWidget(); self.listAccess.setSelectionMode(QAbstractItemView.NoSelection)
@@ -1385,72 +2205,113 @@ class UsersDialog(QDialog):
         self.load(); enable_autosize(self, 0.9, 0.8, 1200, 680)
 
     def _fill_lists_static(self):
-        self.listAccess.clear()
+        # (item, id) guardados em listas Python: trocar de usuário não volta a chamar item(i)/data()
+        self._access_items=[]; self.listAccess.clear()
         for c in self.db.list_companies():
             it=QListWidgetItem(c["razao_social"]); it.setData(Qt.UserRole, c["id"]); it.setFlags(it.flags() | Qt.ItemIsUserCheckable); it.setCheckState(Qt.Unchecked)
-            self.listAccess.addItem(it)
-        self.listPerm.clear()
+            self.listAccess.addItem(it); self._access_items.append((it, c["id"]))
+        self._perm_items=[]; self.listPerm.clear()
         for p in self.db.permissions_all():
             it=QListWidgetItem(f"{p['name']} ({p['code']})"); it.setData(Qt.UserRole, p["id"]); it.setFlags(it.flags() | Qt.ItemIsUserCheckable); it.setCheckState(Qt.Unchecked)
-            self.listPerm.addItem(it)
+            self.listPerm.addItem(it); self._perm_items.append((it, p["id"]))
 
     def load(self):
-        self._fill_lists_static()
-        rows=self.db.users_all(); self.table.setRowCount(0)
-        for r in rows:
-            row=self.table.rowCount(); self.table.insertRow(row)
-            data=[r["id"], r["name"], r["username"], "1" if r["is_admin"] else "0", "1" if r["active"] else "0", iso_to_br(str(r["created_at"])[:10])]
-            for c,val in enumerate(data):
-                it=QTableWidgetItem("" if val is None else str(val)); 
-                if c in (0,5): it.setFlags(it.flags() & ~Qt.ItemIsEditable)
-                self.table.setItem(row,c,it)
-        if rows: self.table.selectRow(0); self.load_right_panel(0,0,0,0)
+        self._loading=True; self._panel_timer.stop()
+        try:
+            self._fill_lists_static()
+            # acessos/permissões de todos os usuários em 2 consultas (evita N consultas por seleção)
+            self._acc_map=self.db.user_access_all(); self._perm_map=self.db.user_permissions_all()
+            rows=self.db.users_all()
+            self.model.set_rows([
+                (r["id"], r["name"], r["username"], "1" if r["is_admin"] else "0", "1" if r["active"] else "0", (r["created_br"] or ""))
+                for r in rows
+            ])
+            if rows: self.table.selectRow(0)
+        finally:
+            self._loading=False
+        if rows: self.load_right_panel()
+
+    def _schedule_right_panel(self, *args):
+        if not self._loading: self._panel_timer.start()
+
+    def _flush_right_panel(self):
+        # painel ainda mostra o usuário anterior: aplica antes de ler os checks
+        if self._panel_timer.isActive():
+            self._panel_timer.stop(); self.load_right_panel()
 
     def load_right_panel(self, *args):
-        r=self.table.currentRow()
+        r=self.table.currentIndex().row()
         if r<0: return
-        id_txt=self.table.item(r,0).text() if self.table.item(r,0) else ""
+        id_txt=self.model.text(r,0)
         if not id_txt.strip().isdigit(): 
-            for i in range(self.listAccess.count()): self.listAccess.item(i).setCheckState(Qt.Unchecked)
-            for i in range(self.listPerm.count()): self.listPerm.item(i).setCheckState(Qt.Unchecked)
+            for it, _ in self._access_items: it.setCheckState(Qt.Unchecked)
+            for it, _ in self._perm_items: it.setCheckState(Qt.Unchecked)
             return
         uid=int(id_txt)
-        access=self.db.company_access_map(uid)
-        for i in range(self.listAccess.count()):
-            it=self.listAccess.item(i); it.setCheckState(Qt.Checked if it.data(Qt.UserRole) in access else Qt.Unchecked)
-        perm_map=self.db.user_perm_map(uid)
-        for i in range(self.listPerm.count()):
-            it=self.listPerm.item(i); it.setCheckState(Qt.Checked if perm_map.get(it.data(Qt.UserRole), False) else Qt.Unchecked)
+        access=self._acc_map.get(uid, set())
+        for it, cid in self._access_items:
+            it.setCheckState(Qt.Checked if cid in access else Qt.Unchecked)
+        perm_map=self._perm_map.get(uid, {})
+        for it, pid in self._perm_items:
+            it.setCheckState(Qt.Checked if perm_map.get(pid, False) else Qt.Unchecked)
 
     def add(self):
-        r=self.table.rowCount(); self.table.insertRow(r); self.table.setItem(r,0,QTableWidgetItem(""))
-        self.table.setItem(r,3,QTableWidgetItem("0")); self.table.setItem(r,4,QTableWidgetItem("1"))
+        r=self.model.append_row(["", "", "", "0", "1", ""])
+        self.table.setCurrentIndex(self.model.index(r,1))
 
     def save(self):
-        for r in range(self.table.rowCount()):
-            id_txt=self.table.item(r,0).text() if self.table.item(r,0) else ""
+        self._flush_right_panel()
+        # 1) valida todas as linhas e monta os registros, sem tocar no banco
+        m=self.model; txt=m.text; cur=self.table.currentIndex().row()
+        items=[]
+        for r in range(m.rowCount()):
+            id_txt=txt(r,0)
+            # linha sem edição só é regravada se for a selecionada (acessos/permissões)
+            if id_txt.strip().isdigit() and r not in m.dirty and r != cur: continue
             rec=dict(
-                name=self.table.item(r,1).text() if self.table.item(r,1) else "",
-                username=self.table.item(r,2).text() if self.table.item(r,2) else "",
-                is_admin=1 if (self.table.item(r,3) and self.table.item(r,3).text() not in ("0","False","false")) else 0,
-                active=1 if (self.table.item(r,4) and self.table.item(r,4).text() not in ("0","False","false")) else 0
+                name=txt(r,1),
+                username=txt(r,2),
+                is_admin=0 if txt(r,3) in ("0","False","false") else 1,
+                active=0 if txt(r,4) in ("0","False","false") else 1
             )
-            if not rec["name"] or not rec["username"]: msg_err("Nome e Usuário são obrigatórios."); return
+            if not rec["name"] or not rec["username"]: msg_err(f"Nome e Usuário são obrigatórios (linha {r+1})."); return
             uid=int(id_txt) if id_txt.strip().isdigit() else None
-            uid=self.db.user_save(rec, uid); self.table.setItem(r,0,QTableWidgetItem(str(uid)))
-            # salvar acessos/permissões do usuário selecionado
-            if r == self.table.currentRow():
-                access_ids=[self.listAccess.item(i).data(Qt.UserRole) for i in range(self.listAccess.count()) if self.listAccess.item(i).checkState()==Qt.Checked]
-                perm_ids=[self.listPerm.item(i).data(Qt.UserRole) for i in range(self.listPerm.count()) if self.listPerm.item(i).checkState()==Qt.Checked]
-                self.db.set_company_access(uid, access_ids)
-                self.db.set_user_permissions(uid, set(perm_ids))
-        msg_info("Usuários salvos."); self.load()
+            # 2) KDF da senha inicial dos novos antes da transação (banco livre enquanto calcula)
+            items.append((r, uid, rec, None if uid else new_password_record(rec.get("password", "123456"))))
+        access={cid for it, cid in self._access_items if it.checkState()==Qt.Checked}
+        perm={pid: it.checkState()==Qt.Checked for it, pid in self._perm_items}
+
+        # 3) só as gravações dentro da transação: um COMMIT para usuários, acessos e permissões
+        saved=[]
+        try:
+            with self.db.transaction():
+                for r, uid, rec, pw in items:
+                    uid=self.db.user_save(rec, uid, pw)
+                    saved.append((r, uid))
+                    # acessos/permissões do usuário selecionado: só o que mudou desde load()
+                    if r == cur:
+                        old_access=self._acc_map.get(uid, set())
+                        self.db.apply_access_diff(uid, access-old_access, old_access-access)
+                        old_perm=self._perm_map.get(uid, {})
+                        self.db.apply_permission_diff(uid, [(pid, on) for pid, on in perm.items() if old_perm.get(pid, False) != on])
+        except sqlite3.IntegrityError as e:
+            # transação já desfeita: a mensagem não segura o banco travado
+            msg_err(f"Não foi possível salvar (usuário duplicado?).\n{e}"); return
+
+        # 4) após o COMMIT: ajusta as linhas e os mapas do painel (a grade não é recarregada)
+        for (r, old_id, rec, _), (_, uid) in zip(items, saved):
+            if old_id is None: m.set_text(r,5,today_br_utc())
+            m.set_text(r,0,str(uid)); m.set_text(r,3,str(rec["is_admin"])); m.set_text(r,4,str(rec["active"]))
+            if r == cur:
+                self._acc_map[uid]=access
+                self._perm_map[uid]={**self._perm_map.get(uid, {}), **perm}
+        m.dirty.clear(); msg_info("Usuários salvos.")
 
     def delete(self):
-        r=self.table.currentRow()
+        r=self.table.currentIndex().row()
         if r<0: return
-        id_txt=self.table.item(r,0).text() if self.table.item(r,0) else ""
-        if not id_txt.strip().isdigit(): self.table.removeRow(r); return
+        id_txt=self.model.text(r,0)
+        if not id_txt.strip().isdigit(): self.model.remove_row(r); return
         auth=AdminAuthDialog(self.db, self)
         if not (auth.exec_() and auth.ok): return
         if not msg_yesno("Excluir este usuário?"): return
@@ -1459,9 +2320,9 @@ class UsersDialog(QDialog):
         self.load()
 
     def set_password(self):
-        r=self.table.currentRow()
+        r=self.table.currentIndex().row()
         if r<0: return
-        id_txt=self.table.item(r,0).text() if self.table.item(r,0) else ""
+        id_txt=self.model.text(r,0)
         if not id_txt.strip().isdigit(): msg_err("Salve o usuário antes de definir a senha."); return
         uid=int(id_txt)
         dlg=QDialog(self); dlg.setWindowTitle("Definir Senha"); form=QFormLayout(dlg)
@@ -1474,6 +2335,8 @@ class UsersDialog(QDialog):
             self.db.user_set_password(uid, p1.text()); msg_info("Senha atualizada.")
 
 class BanksDialog(QDialog):
+    RO_COLS = frozenset({0, 6, 8})  # não editáveis: ID, Saldo Atual, Criado em
+
     def __init__(self, db: DB, company_id: int, parent=None):
         super().__init__(parent)
         self.db = db
@@ -1521,10 +2384,17 @@ class BanksDialog(QDialog):
 
     def load(self):
         rows = self.db.banks(self.company_id)
-        self.table.setRowCount(0)
-        for r in rows:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
+        table = self.table
+        setItem = table.setItem
+        # protótipo por coluna (flags resolvidas uma vez): clone() + setText() por célula
+        ro = QTableWidgetItem(); ro.setFlags(RO_ITEM_FLAGS); rw = QTableWidgetItem()
+        protos = [ro if c in self.RO_COLS else rw for c in range(table.columnCount())]
+        # sem repaint/sinais durante o preenchimento; linhas pré-alocadas
+        table.setUpdatesEnabled(False)
+        blocked = table.blockSignals(True)
+        table.setRowCount(0)
+        table.setRowCount(len(rows))
+        for row, r in enumerate(rows):
             # Sem 'account_name'; 'Tipo' é account_type
             data = [
                 r["id"],
@@ -1535,14 +2405,14 @@ class BanksDialog(QDialog):
                 fmt_brl(r["initial_balance"]),
                 fmt_brl(r["current_balance"]),
                 r["active"],
-                iso_to_br(str(r["created_at"])[:10]),
+                (r["created_br"] or ""),
             ]
             for c, val in enumerate(data):
-                it = QTableWidgetItem("" if val is None else str(val))
-                # Tornar não editáveis: ID, Saldo Atual, Criado em
-                if c in (0, 6, 8):
-                    it.setFlags(it.flags() & ~Qt.ItemIsEditable)
-                self.table.setItem(row, c, it)
+                it = protos[c].clone()
+                it.setText("" if val is None else str(val))
+                setItem(row, c, it)
+        table.blockSignals(blocked)
+        table.setUpdatesEnabled(True)
 
     def add(self):
         r = self.table.rowCount()
@@ -1556,28 +2426,47 @@ class BanksDialog(QDialog):
         for c in (6, 8):
             it = self.table.item(r, c)
             if it:
-                it.setFlags(it.flags() & ~Qt.ItemIsEditable)
+                it.setFlags(RO_ITEM_FLAGS)
 
     def save(self):
+        items, rows_idx = [], []
         for r in range(self.table.rowCount()):
-            id_txt = self.table.item(r, 0).text() if self.table.item(r, 0) else ""
+            t = row_texts(self.table, r)
+            id_txt = t[0]
             rec = dict(
-                bank_name     = self.table.item(r, 1).text() if self.table.item(r, 1) else "",
+                bank_name     = t[1],
                 account_name  = "",  # removido da UI; mantemos vazio para o método bank_save
-                account_type  = (self.table.item(r, 2).text() if self.table.item(r, 2) else "CORRENTE").upper(),
-                agency        = self.table.item(r, 3).text() if self.table.item(r, 3) else "",
-                account_number= self.table.item(r, 4).text() if self.table.item(r, 4) else "",
-                initial_balance = parse_brl(self.table.item(r, 5).text() if self.table.item(r, 5) else "0"),
-                current_balance = parse_brl(self.table.item(r, 6).text() if self.table.item(r, 6) else "0"),
-                active        = 1 if (self.table.item(r, 7) and self.table.item(r, 7).text() not in ("0","False","false")) else 0,
+                account_type  = (t[2] or "CORRENTE").upper(),
+                agency        = t[3],
+                account_number= t[4],
+                initial_balance = parse_brl(t[5]),
+                current_balance = parse_brl(t[6]),
+                active        = 0 if t[7] in ("0","False","false") else 1,
             )
 
             bid = int(id_txt) if id_txt.strip().isdigit() else None
-            bid = self.db.bank_save(self.company_id, rec, bid)
-            self.table.setItem(r, 0, QTableWidgetItem(str(bid)))
-
+            items.append((bid, rec)); rows_idx.append(r)
+
+        # um COMMIT para todas as linhas; UPDATEs num executemany.
+        # sem recarregar a grade: só ID/formatação das linhas gravadas são ajustados
+        today = today_br_utc()
+        blocked = self.table.blockSignals(True)
+        for r, (old_id, rec), bid in zip(rows_idx, items, self.db.banks_bulk_save(self.company_id, items)):
+            self._set_text(r, 0, str(bid)); self._set_text(r, 2, rec["account_type"])
+            self._set_text(r, 5, fmt_brl(rec["initial_balance"])); self._set_text(r, 6, fmt_brl(rec["current_balance"]))
+            self._set_text(r, 7, str(rec["active"]))
+            if old_id is None: self._set_text(r, 8, today)
+        self.table.blockSignals(blocked)
         msg_info("Bancos salvos.")
-        self.load()
+
+    def _set_text(self, r, c, text):
+        it = self.table.item(r, c)
+        if it is None:
+            it = QTableWidgetItem()
+            if c in self.RO_COLS:
+                it.setFlags(RO_ITEM_FLAGS)
+            self.table.setItem(r, c, it)
+        it.setText(text)
 
     def delete(self):
         r = self.table.currentRow()
@@ -1645,30 +2534,49 @@ class EntitiesDialog(QDialog):
         hl = QHBoxLayout(); [hl.addWidget(b) for b in (btAdd, btSave, btDel, btReload)]
         lay.addLayout(hl)
 
+        self._query_seq = 0; self._query_job = None
         self.load()
         enable_autosize(self, 0.85, 0.75, 1100, 650)
 
     def load(self):
-        rows = self.db.entities(self.company_id)
-        # desabilita ordenação durante o preenchimento para acelerar e não reordenar no meio
-        was_sorting = self.table.isSortingEnabled()
-        self.table.setSortingEnabled(False)
-
-        self.table.setRowCount(0)
-        for r in rows:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
+        # consulta no pool; _query_seq descarta respostas de recargas anteriores
+        self._query_seq += 1
+        seq = self._query_seq
+        self._query_job = start_query(
+            self.db, DB.entities, self.company_id, on_done=lambda rows, seq=seq: self._populate(seq, rows)
+        )
 
-            # formatações de exibição
+    def _populate(self, seq, rows):
+        if seq != self._query_seq:
+            return
+        self._query_job = None
+        if isinstance(rows, Exception):
+            msg_err(str(rows), self)
+            return
+        # desabilita ordenação durante o preenchimento para acelerar e não reordenar no meio
+        table = self.table
+        was_sorting = table.isSortingEnabled()
+        table.setSortingEnabled(False)
+        setItem = table.setItem
+        UserRole = Qt.UserRole; EditRole = Qt.EditRole
+        # protótipos de célula: só o ID (coluna 0) não é editável
+        ro = QTableWidgetItem(); ro.setFlags(RO_ITEM_FLAGS); rw = QTableWidgetItem()
+        protos = [ro] + [rw] * (table.columnCount() - 1)
+        # sem repaint/sinais durante o preenchimento; linhas pré-alocadas
+        table.setUpdatesEnabled(False)
+        blocked = table.blockSignals(True)
+
+        table.setRowCount(0)
+        table.setRowCount(len(rows))
+        for row, r in enumerate(rows):
+            # formatações de exibição (dígitos limpos uma vez; reaproveitados na ordenação)
             doc = r["cnpj_cpf"] or ""
-            d = only_digits(doc)
-            if len(d) == 11: doc = format_cpf(d)
-            elif len(d) == 14: doc = format_cnpj(d)
+            doc_dig = only_digits(doc)
+            if len(doc_dig) in (11, 14): doc = format_doc_digits(doc_dig)
 
             cep = r["cep"] or ""
-            if cep:
-                dcep = only_digits(cep)
-                cep = f"{dcep[:5]}-{dcep[5:]}" if len(dcep) == 8 else cep
+            cep_dig = only_digits(cep)
+            if len(cep_dig) == 8: cep = f"{cep_dig[:5]}-{cep_dig[5:]}"
 
             data = [
                 r["id"], r["kind"], doc, r["razao_social"], r["contato1"], r["contato2"],
@@ -1677,36 +2585,35 @@ class EntitiesDialog(QDialog):
 
             for c, val in enumerate(data):
                 txt = "" if val is None else str(val)
-                it = QTableWidgetItem(txt)
-                if c == 0:  # ID não editável
-                    it.setFlags(it.flags() & ~Qt.ItemIsEditable)
+                it = protos[c].clone()
+                it.setText(txt)
 
                 # --- CNPJ/CPF (ordenar pelos dígitos numéricos)
                 if c == 2:
-                    dig = only_digits(txt)
-                    if dig.isdigit():
-                        it.setData(Qt.UserRole, int(dig))   # chave de ordenação
-                        it.setData(Qt.EditRole, int(dig))   # PyQt5 usa EditRole na ordenação
+                    if doc_dig:
+                        it.setData(UserRole, int(doc_dig))   # chave de ordenação
+                        it.setData(EditRole, int(doc_dig))   # PyQt5 usa EditRole na ordenação
 
                 # --- Nº (numérico)
                 elif c == 8:
                     try:
                         n = int(txt)
-                        it.setData(Qt.UserRole, n)
-                        it.setData(Qt.EditRole, n)
+                        it.setData(UserRole, n)
+                        it.setData(EditRole, n)
                     except Exception:
                         pass
 
                 # --- CEP (ordenar pelos dígitos)
                 elif c == 9:
-                    dig = only_digits(txt)
-                    if dig.isdigit():
-                        it.setData(Qt.UserRole, int(dig))
-                        it.setData(Qt.EditRole, int(dig))
-                self.table.setItem(row, c, it)
+                    if cep_dig:
+                        it.setData(UserRole, int(cep_dig))
+                        it.setData(EditRole, int(cep_dig))
+                setItem(row, c, it)
 
+        table.blockSignals(blocked)
         # reabilita ordenação
-        self.table.setSortingEnabled(was_sorting)
+        table.setSortingEnabled(was_sorting)
+        table.setUpdatesEnabled(True)
 
     def add(self):
         r = self.table.rowCount()
@@ -1715,43 +2622,42 @@ class EntitiesDialog(QDialog):
         self.table.setItem(r, 1, QTableWidgetItem("FORNECEDOR"))    # tipo padrão
 
     def save(self):
+        # valida todas as linhas antes; grava tudo de uma vez no final
+        items, rows_idx = [], []
         for r in range(self.table.rowCount()):
-            id_txt = self.table.item(r, 0).text() if self.table.item(r, 0) else ""
-            kind = (self.table.item(r, 1).text() if self.table.item(r, 1) else "FORNECEDOR").upper()
+            t = row_texts(self.table, r)
+            id_txt = t[0]
+            kind = t[1].upper()
             if kind not in ("FORNECEDOR", "CLIENTE", "AMBOS"):
                 kind = "FORNECEDOR"
 
 
-            doc = self.table.item(r, 2).text() if self.table.item(r, 2) else ""
-            d = only_digits(doc)
+            d = only_digits(t[2])
             if d:
                 if len(d) == 11 and not validate_cpf(d): msg_err(f"CPF inválido (linha {r+1})."); return
                 if len(d) == 14 and not validate_cnpj(d): msg_err(f"CNPJ inválido (linha {r+1})."); return
                 if len(d) not in (11, 14): msg_err(f"Documento deve ter 11 (CPF) ou 14 (CNPJ) dígitos (linha {r+1})."); return
 
-            cep = self.table.item(r, 9).text() if self.table.item(r, 9) else ""
-            uf = self.table.item(r,10).text().upper() if self.table.item(r,10) else ""
+            cep = t[9]
+            uf = t[10].upper()
             if cep and not validate_cep(cep): msg_err(f"CEP inválido (linha {r+1})."); return
             if uf and not validate_uf(uf): msg_err(f"UF inválida (linha {r+1})."); return
 
             rec = dict(
                 kind=kind, cnpj_cpf=d,
-                razao_social=self.table.item(r,3).text() if self.table.item(r,3) else "",
-                contato1=self.table.item(r,4).text() if self.table.item(r,4) else "",
-                contato2=self.table.item(r,5).text() if self.table.item(r,5) else "",
-                rua=self.table.item(r,6).text() if self.table.item(r,6) else "",
-                bairro=self.table.item(r,7).text() if self.table.item(r,7) else "",
-                numero=self.table.item(r,8).text() if self.table.item(r,8) else "",
+                razao_social=t[3], contato1=t[4], contato2=t[5],
+                rua=t[6], bairro=t[7], numero=t[8],
                 cep=only_digits(cep), uf=uf,
-                cidade=self.table.item(r,11).text() if self.table.item(r,11) else "",
-                email=self.table.item(r,12).text() if self.table.item(r,12) else "",
+                cidade=t[11], email=t[12],
                 active=1
             )
             if not rec["razao_social"]:
                 msg_err("Razão/Nome é obrigatório."); return
 
             eid = int(id_txt) if id_txt.strip().isdigit() else None
-            eid = self.db.entity_save(self.company_id, rec, eid)
+            items.append((eid, rec)); rows_idx.append(r)
+
+        for r, eid in zip(rows_idx, self.db.entities_bulk_save(self.company_id, items)):
             self.table.setItem(r, 0, QTableWidgetItem(str(eid)))
 
         msg_info("Registros salvos.")
@@ -1803,6 +2709,13 @@ class CategoriesDialog(QDialog):
         zebra_table(self.tblSub)
         self.tblSub.setColumnHidden(0, True)
 
+        # protótipos de célula: clone() + setText() em vez de recalcular flags por célula
+        self._rw_proto = QTableWidgetItem()
+        self._ro_proto = QTableWidgetItem()
+        self._ro_proto.setFlags(RO_ITEM_FLAGS)
+        # category_id -> subcategorias; trocar de categoria não volta ao banco
+        self._subs_by_cat = {}
+
         # botões
         btAddC = QPushButton("Nova Categoria")
         btSaveC = QPushButton("Salvar Cat.")
@@ -1854,16 +2767,26 @@ class CategoriesDialog(QDialog):
     def load(self):
         tipo = self.cbTipo.currentText()
         rows = self.db.categories(self.company_id, tipo)
-        self.tblCat.setRowCount(0)
+        # subcategorias da empresa numa consulta só; categoria sem subs já entra vazia
+        subs_by_cat = self._subs_by_cat = {r["id"]: [] for r in rows}
+        for s in self.db.subcategories_for_company(self.company_id):
+            if s["category_id"] in subs_by_cat:
+                subs_by_cat[s["category_id"]].append(s)
+        tbl = self.tblCat
         self.tblSub.setRowCount(0)
-        for r in rows:
-            row = self.tblCat.rowCount()
-            self.tblCat.insertRow(row)
+        # sem repaint/sinais durante o preenchimento; linhas pré-alocadas
+        tbl.setUpdatesEnabled(False)
+        blocked = tbl.blockSignals(True)
+        tbl.setRowCount(0)
+        tbl.setRowCount(len(rows))
+        ro, rw = self._ro_proto, self._rw_proto
+        for row, r in enumerate(rows):
             for c, val in enumerate([r["id"], r["name"], r["tipo"]]):
-                it = QTableWidgetItem("" if val is None else str(val))
-                if c == 0:
-                    it.setFlags(it.flags() & ~Qt.ItemIsEditable)
-                self.tblCat.setItem(row, c, it)
+                it = (ro if c == 0 else rw).clone()
+                it.setText("" if val is None else str(val))
+                tbl.setItem(row, c, it)
+        tbl.blockSignals(blocked)
+        tbl.setUpdatesEnabled(True)
         if rows:
             self.tblCat.selectRow(0)
             self.load_subs(0, 0, 0, 0)
@@ -1876,13 +2799,20 @@ class CategoriesDialog(QDialog):
         id_txt = self.tblCat.item(r, 0).text() if self.tblCat.item(r, 0) else ""
         if not id_txt.strip().isdigit():
             return
-        for s in self.db.subcategories(int(id_txt)):
-            row = self.tblSub.rowCount()
-            self.tblSub.insertRow(row)
-            it0 = QTableWidgetItem(str(s["id"]))
-            it0.setFlags(it0.flags() & ~Qt.ItemIsEditable)
-            self.tblSub.setItem(row, 0, it0)
-            self.tblSub.setItem(row, 1, QTableWidgetItem(s["name"]))
+        cat_id = int(id_txt)
+        subs = self._subs_by_cat.get(cat_id)
+        if subs is None:  # categoria recém-gravada ou cache invalidado
+            subs = self._subs_by_cat[cat_id] = self.db.subcategories(cat_id)
+        tbl = self.tblSub
+        tbl.setUpdatesEnabled(False)
+        tbl.setRowCount(len(subs))
+        ro, rw = self._ro_proto, self._rw_proto
+        for row, s in enumerate(subs):
+            it0 = ro.clone(); it0.setText(str(s["id"]))
+            it1 = rw.clone(); it1.setText(s["name"])
+            tbl.setItem(row, 0, it0)
+            tbl.setItem(row, 1, it1)
+        tbl.setUpdatesEnabled(True)
 
     # ----------------- helpers -----------------
     def _current_cat_row(self):
@@ -1933,24 +2863,29 @@ class CategoriesDialog(QDialog):
 
     def save_cat(self):
         """Salva todas as categorias listadas."""
-        ok_any = False
+        items, rows_idx, seen = [], [], set()
         for r in range(self.tblCat.rowCount()):
-            id_txt = self.tblCat.item(r, 0).text() if self.tblCat.item(r, 0) else ""
-            name = self.tblCat.item(r, 1).text().strip() if self.tblCat.item(r, 1) else ""
-            tipo = self.tblCat.item(r, 2).text().strip() if self.tblCat.item(r, 2) else self.cbTipo.currentText()
+            id_txt, name, tipo = row_texts(self.tblCat, r)
+            name = name.strip(); tipo = tipo.strip() or self.cbTipo.currentText()
             if not name:
                 continue
-            cid = int(id_txt) if id_txt.strip().isdigit() else None
-            try:
-                cid = self.db.category_save(self.company_id, name, tipo, cid)
-                self.tblCat.setItem(r, 0, QTableWidgetItem(str(cid)))
-                ok_any = True
-            except sqlite3.IntegrityError:
+            if (name, tipo) in seen:
                 msg_err(f"Categoria '{name}' já existe para este tipo.")
                 return False
-        if ok_any:
-            return True
-        return False
+            seen.add((name, tipo))
+            cid = int(id_txt) if id_txt.strip().isdigit() else None
+            items.append((cid, name, tipo)); rows_idx.append(r)
+        if not items:
+            return False
+        # um único COMMIT (UPDATEs num executemany); conflito desfaz o lote inteiro
+        try:
+            ids = self.db.categories_bulk_save(self.company_id, items)
+        except sqlite3.IntegrityError:
+            msg_err("Categoria já existe para este tipo.")
+            return False
+        for r, cid in zip(rows_idx, ids):
+            self.tblCat.item(r, 0).setText(str(cid))
+        return True
 
     def save_cat_and_subs(self):
         """Botão 'Salvar Cat.' também salva subcategorias da categoria atual."""
@@ -2000,24 +2935,31 @@ class CategoriesDialog(QDialog):
         if not cat_id:
             return
 
-        any_saved = False
+        items, seen = [], set()
         for r in range(self.tblSub.rowCount()):
-            id_txt = self.tblSub.item(r, 0).text() if self.tblSub.item(r, 0) else ""
-            name = self.tblSub.item(r, 1).text().strip() if self.tblSub.item(r, 1) else ""
+            id_txt, name = row_texts(self.tblSub, r)
+            name = name.strip()
             if not name:
                 continue
-            sid = int(id_txt) if id_txt.strip().isdigit() else None
-            try:
-                sid = self.db.subcategory_save(cat_id, name, sid)
-                self.tblSub.setItem(r, 0, QTableWidgetItem(str(sid)))
-                any_saved = True
-            except sqlite3.IntegrityError:
+            if name in seen:
                 msg_err(f"Subcategoria '{name}' já existe nesta categoria.")
                 return
+            seen.add(name)
+            items.append((int(id_txt) if id_txt.strip().isdigit() else None, name))
+
+        # um único COMMIT (UPDATEs num executemany); conflito desfaz o lote inteiro
+        try:
+            if items:
+                self.db.subcategories_bulk_save(cat_id, items)
+        except sqlite3.IntegrityError:
+            self._subs_by_cat.pop(cat_id, None)
+            msg_err("Subcategoria já existe nesta categoria.")
+            return
 
-        if show_msg and any_saved:
+        if show_msg and items:
             msg_info("Subcategorias salvas.")
         # Recarrega para refletir o que ficou gravado
+        self._subs_by_cat.pop(cat_id, None)
         self.load_subs()
 
     def del_sub(self):
@@ -2035,6 +2977,9 @@ class CategoriesDialog(QDialog):
         except sqlite3.IntegrityError as e:
             msg_err("Não foi possível excluir. Há lançamentos vinculados.\n" + str(e))
             return
+        cat_txt = self._current_cat_fields()[1]
+        if cat_txt.strip().isdigit():
+            self._subs_by_cat.pop(int(cat_txt), None)
         self.load_subs()
 
 # =============================================================================
@@ -2074,6 +3019,46 @@ def set_combo_by_data(cb: QComboBox, value):
     if idx >= 0:
         cb.setCurrentIndex(idx)
 
+def sync_typed_combo(cb: QComboBox) -> bool:
+    """
+    Combo editável (busca por digitação, NoInsert): alinha o item atual ao texto
+    digitado — igual, sem diferenciar maiúsculas. Se o item atual já tem esse
+    texto ele é mantido (nomes repetidos: vale o que o usuário escolheu); senão
+    usa o primeiro igual. Sem correspondência volta ao item em branco (índice 0)
+    e devolve False; o currentData() nunca fica apontando para um item anterior
+    que o usuário não escolheu.
+    """
+    txt = cb.currentText().strip()
+    cur = cb.currentIndex()
+    if not txt:
+        idx = 0
+    elif cur >= 0 and cb.itemText(cur).strip().casefold() == txt.casefold():
+        idx = cur
+    else:
+        idx = cb.findText(txt, Qt.MatchFixedString)
+    ok = idx >= 0
+    if not ok:
+        idx = 0
+    cb.setCurrentIndex(idx)
+    cb.setEditText(cb.itemText(idx))
+    return ok
+
+def fill_combo(cb: QComboBox, items, blank=True):
+    """
+    Repovoa o combo com pares (texto, dado) montando o modelo fora da view e
+    trocando de uma vez (uma atualização em vez de uma por addItem).
+    """
+    model = QStandardItemModel(cb)  # pai = combo: o modelo anterior é descartado no setModel
+    if blank:
+        it = QStandardItem("")
+        it.setData(None, Qt.UserRole)
+        model.appendRow(it)
+    for text, data in items:
+        it = QStandardItem(text)
+        it.setData(data, Qt.UserRole)
+        model.appendRow(it)
+    cb.setModel(model)
+
 # ======== SUBSTITUA A CLASSE TransactionsDialog INTEIRA POR ESTA ============
 class TransactionsDialog(QDialog):
     data_changed = pyqtSignal()  # notifica o dashboard
@@ -2093,6 +3078,15 @@ class TransactionsDialog(QDialog):
 
         btn = None
         if with_button:
+            # busca digitando qualquer trecho do nome (listas longas de fornecedores/clientes)
+            combo.setEditable(True)
+            combo.setInsertPolicy(QComboBox.NoInsert)
+            comp = combo.completer()
+            comp.setCompletionMode(QCompleter.PopupCompletion)
+            comp.setFilterMode(Qt.MatchContains)
+            comp.setCaseSensitivity(Qt.CaseInsensitive)
+            # texto digitado sem item correspondente não troca o item atual:
+            # quem lê o combo resolve o texto com sync_typed_combo antes de currentData()
             btn = QPushButton("", self)
             btn.setFixedSize(28, 28)
             btn.setIcon(std_icon(self, self.style().SP_FileDialogContentsView))
@@ -2115,6 +3109,8 @@ class TransactionsDialog(QDialog):
         self.user_id = user_id
         self.current_tx_id = None
         self._rows_by_id = {}
+        self._query_seq = 0
+        self._query_job = None
 
         self.setWindowTitle("Lançamentos")
 
@@ -2260,7 +3256,7 @@ class TransactionsDialog(QDialog):
         top_row.addWidget(right_wrap, 1)
 
         # ================================ TABELA ================================
-        self.table = QTableWidget(0, 14)
+        self.table = QTableView()
         headers = [
             "Status",
             "Forma de Pagamento",
@@ -2277,7 +3273,11 @@ class TransactionsDialog(QDialog):
             "Tipo",
             "ID",
         ]
-        self.table.setHorizontalHeaderLabels(headers)
+        self.model = RowsTableModel(headers, align_right=(2, 3), parent=self)  # valores à direita
+        self.table.setModel(self.model)
+        brl = BRLDelegate(self.table)
+        self.table.setItemDelegateForColumn(2, brl)
+        self.table.setItemDelegateForColumn(3, brl)
         self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.table.setSelectionMode(QAbstractItemView.SingleSelection)
@@ -2369,7 +3369,7 @@ class TransactionsDialog(QDialog):
         QGroupBox::title { subcontrol-origin: margin; left: 10px; padding: 0 2px; }
         QPushButton { border: 1px solid #d0d0d0; border-radius: 8px; padding: 6px 12px; background: #f7f7f7; }
         QPushButton:hover { background: #f0f0f0; }
-        QTableWidget { gridline-color: #e2e2e2; }
+        QTableView { gridline-color: #e2e2e2; }
         QHeaderView::section { background: #f2f2f2; padding: 6px; border: 1px solid #e0e0e0; }
         """
         )
@@ -2385,7 +3385,7 @@ class TransactionsDialog(QDialog):
         self.btLiquidar.clicked.connect(self.liquidar)
         self.btCancelar.clicked.connect(self.cancel_selected)
         self.btPesquisar.clicked.connect(self.apply_filters)
-        self.table.itemSelectionChanged.connect(self._update_status_from_selection)
+        self.table.selectionModel().selectionChanged.connect(self._update_status_from_selection)
         self.cbCat.currentIndexChanged.connect(self._load_subcategories_for_form)
         if self.btFindEnt:
             self.btFindEnt.clicked.connect(self._open_entities_and_refresh)
@@ -2405,14 +3405,27 @@ class TransactionsDialog(QDialog):
         self.setWindowFlag(Qt.WindowMinMaxButtonsHint, True)
 
     # --------------------------- dados estáticos ---------------------------
+    def _load_lookup_caches(self):
+        """Entidades/categorias/subcategorias/bancos em memória (4 consultas por abertura)."""
+        self._ents_all = self.db.entities(self.company_id)
+        self._cats_by_tipo = {"PAGAR": [], "RECEBER": []}
+        for c in self.db.categories(self.company_id):
+            self._cats_by_tipo.setdefault(c["tipo"], []).append(c)
+        self._subs_by_cat = {}
+        for s in self.db.subcategories_for_company(self.company_id):
+            self._subs_by_cat.setdefault(s["category_id"], []).append(s)
+        self._banks = self.db.banks(self.company_id)
+        self._bank_by_id = {b["id"]: b for b in self._banks}
+
     def populate_static(self):
+        self._load_lookup_caches()
         # bancos (form + painel saldo)
         self.cbBanco.blockSignals(True)
         self.cbBanco.clear()
         self.cmbSaldoBanco.blockSignals(True)
         self.cmbSaldoBanco.clear()
         total = 0.0
-        for b in self.db.banks(self.company_id):
+        for b in self._banks:
             label = f"{b['bank_name']} - {b['account_name'] or ''}"
             self.cbBanco.addItem(label, b["id"])
             self.cmbSaldoBanco.addItem(label, b["id"])
@@ -2438,46 +3451,31 @@ class TransactionsDialog(QDialog):
 
     def _refresh_entities_by_tipo(self):
         kind = "FORNECEDOR" if self._current_tipo() == "PAGAR" else "CLIENTE"
-        self.cbEnt.clear()
-        ents = self.db.entities(self.company_id, kind=kind)
-        self.cbEnt.addItem("", None)
-        for e in ents:
-            self.cbEnt.addItem(e["razao_social"], e["id"])
+        fill_combo(self.cbEnt, [(e["razao_social"], e["id"])
+                                for e in self._ents_all if e["kind"] in (kind, "AMBOS")])
 
     def _refresh_categories_by_tipo(self):
         tipo = self._current_tipo()
-        self.cbCat.clear()
-        cats = self.db.categories(self.company_id, tipo=tipo)
-        self.cbCat.addItem("", None)
-        for c in cats:
-            self.cbCat.addItem(c["name"], c["id"])
+        # sem sinais: clear/addItem disparariam _load_subcategories_for_form a cada
+        # item; quem chama recarrega as subcategorias uma única vez em seguida
+        self.cbCat.blockSignals(True)
+        fill_combo(self.cbCat, [(c["name"], c["id"]) for c in self._cats_by_tipo.get(tipo, [])])
+        self.cbCat.blockSignals(False)
 
     def _load_subcategories_for_form(self):
-        self.cbSub.clear()
         cat_id = self.cbCat.currentData()
-        if not cat_id:
-            self.cbSub.addItem("", None)
-            return
-        subs = self.db.subcategories(cat_id)
-        self.cbSub.addItem("", None)
-        for s in subs:
-            self.cbSub.addItem(s["name"], s["id"])
+        subs = self._subs_by_cat.get(cat_id, []) if cat_id else []
+        fill_combo(self.cbSub, [(s["name"], s["id"]) for s in subs])
 
     def _fill_filter_entities(self):
         # lista completa (independente do tipo) para facilitar filtro
-        self.filForn.clear()
-        self.filForn.addItem("", None)
-        for e in self.db.entities(self.company_id):
-            self.filForn.addItem(e["razao_social"], e["id"])
+        fill_combo(self.filForn, [(e["razao_social"], e["id"]) for e in self._ents_all])
 
     def _fill_filter_categories(self):
-        self.cbCatFiltro.clear()
-        self.cbCatFiltro.addItem("", None)
         # mostra ambas (PAGAR/RECEBER) para filtro
-        for t in ("PAGAR", "RECEBER"):
-            for c in self.db.categories(self.company_id, t):
-                label = f"{c['name']} [{t}]"
-                self.cbCatFiltro.addItem(label, c["id"])
+        fill_combo(self.cbCatFiltro, [(f"{c['name']} [{t}]", c["id"])
+                                      for t in ("PAGAR", "RECEBER")
+                                      for c in self._cats_by_tipo.get(t, [])])
 
     def _refresh_saldos(self):
         # saldo total já preenchido em populate_static; aqui só por banco
@@ -2485,12 +3483,13 @@ class TransactionsDialog(QDialog):
         if not bank_id:
             self.edSaldoBanco.setText("")
             return
-        row = next((b for b in self.db.banks(self.company_id) if b["id"] == bank_id), None)
+        row = self._bank_by_id.get(bank_id)
         self.edSaldoBanco.setText(fmt_brl(row["current_balance"]) if row else "")
 
     def _open_entities_and_refresh(self):
         # abre cadastro para permitir criar/editar e depois recarrega combos
         EntitiesDialog(self.db, self.company_id, self).exec_()
+        self._ents_all = self.db.entities(self.company_id)  # invalida o cache de entidades
         self._refresh_entities_by_tipo()
         self._fill_filter_entities()
 
@@ -2498,27 +3497,11 @@ class TransactionsDialog(QDialog):
     def _current_tipo(self) -> str:
         return "PAGAR" if self.rbPagar.isChecked() else "RECEBER"
 
-    def _rebuild_name_caches(self):
-        self._ent_name = {r["id"]: r["razao_social"] for r in self.db.entities(self.company_id)}
-        self._cat_name = {r["id"]: r["name"] for r in self.db.categories(self.company_id)}
-        # sub precisa passar por todas categorias
-        self._sub_name = {}
-        for cid in self._cat_name.keys():
-            for s in self.db.subcategories(cid):
-                self._sub_name[s["id"]] = s["name"]
-        self._bank_name = {
-            r["id"]: f"{r['bank_name']} - {r['account_name'] or ''}" for r in self.db.banks(self.company_id)
-        }
-
     # ------------------------------- carregar -------------------------------
     def load(self):
         self.apply_filters()
 
     def apply_filters(self):
-        self._rebuild_name_caches()
-        self.table.setRowCount(0)
-        self._rows_by_id = {}
-
         dt_ini = qdate_to_iso(self.filIni.date())
         dt_fim = qdate_to_iso(self.filFim.date())
         tipo_sel = self.cbTipoFiltro.currentText()
@@ -2527,11 +3510,29 @@ class TransactionsDialog(QDialog):
             tipo = "PAGAR"
         elif tipo_sel == "Contas a Receber":
             tipo = "RECEBER"
+        sync_typed_combo(self.filForn)  # texto digitado sem correspondência = sem filtro
+        filters = (dt_ini, dt_fim, self.filForn.currentData(), self.cbCatFiltro.currentData(),
+                   self.cbStatusFiltro.currentText() or "")
+
+        # consulta no pool; só o preenchimento da grade roda na thread da UI.
+        # _query_seq descarta respostas de pesquisas anteriores que cheguem atrasadas
+        self._query_seq += 1
+        seq = self._query_seq
+        self._query_job = start_query(
+            self.db, DB.transactions_with_names, self.company_id, tipo,
+            on_done=lambda rows, seq=seq, f=filters: self._populate(seq, rows, f),
+        )
 
-        rows = self.db.transactions(self.company_id, tipo)
-        ent_filter = self.filForn.currentData()
-        cat_filter = self.cbCatFiltro.currentData()
-        status_filter = self.cbStatusFiltro.currentText() or ""
+    def _populate(self, seq, rows, filters):
+        if seq != self._query_seq:
+            return
+        self._query_job = None
+        if isinstance(rows, Exception):
+            msg_err(str(rows), self)
+            return
+        dt_ini, dt_fim, ent_filter, cat_filter, status_filter = filters
+        self._rows_by_id = {}
+        out = []
 
         for t in rows:
             # período por vencimento
@@ -2554,59 +3555,45 @@ class TransactionsDialog(QDialog):
             if status_filter and status != status_filter:
                 continue
 
-            # juros total e data liquidação (busca rápida nos pagamentos)
-            juros_total = 0.0
+            # juros total e data liquidação (já agregados na consulta)
+            juros_total = float(t["juros"] or 0.0)
             data_liq = ""
-            try:
-                pays = self.db.payments_for(t["id"])
-                if pays:
-                    juros_total = sum(float(p["interest"] or 0.0) for p in pays)
-                    if status == "LIQUIDADO":
-                        # considera última data de pagamento
-                        data_liq = max(str(p["payment_date"]) for p in pays)
-            except Exception:
-                pass
-
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-
-            def _set(r, c, text):
-                it = QTableWidgetItem("" if text is None else str(text))
-                if c in (2, 3):  # valores à direita
-                    it.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
-                self.table.setItem(r, c, it)
-
-            _set(row, 0, status)
-            _set(row, 1, t["forma_pagto"] or "")
-            _set(row, 2, fmt_brl(valor))
-            _set(row, 3, fmt_brl(juros_total) if juros_total else "")
-            _set(row, 4, iso_to_br(data_liq) if data_liq else "")
-            _set(row, 5, iso_to_br(t["data_venc"]))
-            _set(row, 6, t["parcelas_qtd"])
-            _set(row, 7, self._bank_name.get(t["banco_id_padrao"], "") if t["banco_id_padrao"] else "")
-            _set(row, 8, self._ent_name.get(t["entity_id"], ""))
-            _set(row, 9, self._cat_name.get(t["category_id"], ""))
-            _set(row, 10, self._sub_name.get(t["subcategory_id"], ""))
-            _set(row, 11, iso_to_br(t["data_lanc"]))
-            _set(row, 12, t["tipo"])
-            _set(row, 13, t["id"])  # hidden
+            if status == "LIQUIDADO" and t["ultima_data_pag"]:
+                # considera última data de pagamento
+                data_liq = str(t["ultima_data_pag"])
+
+            out.append((
+                status,
+                t["forma_pagto"] or "",
+                valor,  # Valor/Juros crus: BRLDelegate formata na pintura
+                juros_total or None,
+                iso_to_br(data_liq) if data_liq else "",
+                iso_to_br(t["data_venc"]),
+                str(t["parcelas_qtd"]),
+                t["bank_name"],
+                t["entity_name"],
+                t["category_name"],
+                t["subcategory_name"],
+                iso_to_br(t["data_lanc"]),
+                t["tipo"],
+                str(t["id"]),  # hidden
+            ))
 
             self._rows_by_id[int(t["id"])] = dict(t)
 
-        if self.table.rowCount():
+        self.model.set_rows(out)
+        self.table.setColumnHidden(13, True)  # o reset do modelo pode reexibir a coluna ID
+        if out:
             self.table.selectRow(0)
         self._update_status_from_selection()
 
     # ----------------------------- ações de linha ----------------------------
     def _selected_tx_id(self):
-        r = self.table.currentRow()
+        r = self.table.currentIndex().row()
         if r < 0:
             return None
-        it = self.table.item(r, 13)
-        if not it:
-            return None
         try:
-            return int(it.text())
+            return int(self.model.row_at(r)[13])
         except Exception:
             return None
 
@@ -2679,20 +3666,14 @@ class TransactionsDialog(QDialog):
         if not tx_id:
             return
         # carrega dados do tx para passar ao diálogo
-        row = self.db.q(
-            "SELECT t.*, IFNULL((SELECT SUM(p.amount + p.interest - p.discount) FROM payments p WHERE p.transaction_id=t.id),0) AS pago "
-            "FROM transactions t WHERE t.id=?", (tx_id,)
-        )
+        row = self.db.q("SELECT * FROM transactions WHERE id=?", (tx_id,))
         if not row:
             return
         tx = row[0]
         dlg = PaymentDialog(self.db, self.company_id, tx, self.user_id, self)
         if dlg.exec_() and dlg.ok_clicked:
             # atualiza status se liquidado
-            tot = self.db.q(
-                "SELECT IFNULL(SUM(amount + interest - discount),0) AS tot FROM payments WHERE transaction_id=?",
-                (tx_id,),
-            )[0]["tot"]
+            tot = self.db.q("SELECT pago FROM transactions WHERE id=?", (tx_id,))[0]["pago"]
             if float(tot) >= float(tx["valor"] or 0.0) - 1e-6 and (tx["status"] != "CANCELADO"):
                 self.db.e("UPDATE transactions SET status='LIQUIDADO', updated_at=datetime('now') WHERE id=?", (tx_id,))
             self.apply_filters()
@@ -2719,6 +3700,10 @@ class TransactionsDialog(QDialog):
         self.btnStatus.setText("EM ABERTO")
 
     def save(self):
+        typed = self.cbEnt.currentText().strip()
+        if not sync_typed_combo(self.cbEnt):
+            msg_err(f"Fornecedor/Cliente '{typed}' não encontrado. Selecione um item da lista.")
+            return
         tipo = self._current_tipo()
         rec = dict(
             company_id=self.company_id,
@@ -2750,26 +3735,34 @@ class TransactionsDialog(QDialog):
             msg_err(str(e), self)
 
     # --------------------------- reações de UI -------------------------------
-    def on_tipo_changed(self):
+    def on_tipo_changed(self, checked=True):
+        # toggled dispara duas vezes por troca (um rádio desmarca, outro marca):
+        # só reage ao que ficou marcado
+        if not checked:
+            return
         # Atualiza combos dependentes do tipo
         self._refresh_entities_by_tipo()
         self._refresh_categories_by_tipo()
         self._load_subcategories_for_form()
 
-    def _update_status_from_selection(self):
-        r = self.table.currentRow()
+    def _update_status_from_selection(self, *args):
+        r = self.table.currentIndex().row()
         if r < 0:
             self.btnStatus.setText("EM ABERTO")
             return
-        it = self.table.item(r, 0)
-        self.btnStatus.setText(it.text() if it else "EM ABERTO")
+        self.btnStatus.setText(self.model.row_at(r)[0] or "EM ABERTO")
 # ======================== FIM DA NOVA TransactionsDialog ======================
 
 class CashflowDialog(QDialog):
+    HEADERS = ["Valor", "Tipo", "Data da liquidação", "Fornecedor/Cliente", "Categoria", "Subcategoria"]
+    PAGE_SIZE = 500  # linhas na grade; exportações leem o período inteiro direto do banco
+
     def __init__(self, db: DB, company_id: int, parent=None):
         super().__init__(parent)
         self.db = db
         self.company_id = company_id
+        self._query_seq = 0
+        self._query_job = None
         self.setWindowTitle("Fluxo de Caixa")
 
         # período (agora mais largos para não cortar o ano)
@@ -2784,12 +3777,13 @@ class CashflowDialog(QDialog):
         for b in self.db.banks(self.company_id):
             self.cbBank.addItem(f"{b['bank_name']} - {b['account_name'] or ''}", b["id"])
 
-        # tabela com as colunas solicitadas
-        self.table = QTableWidget(0, 6)
-        self.table.setHorizontalHeaderLabels([
-            "Valor", "Tipo", "Data da liquidação",
-            "Fornecedor/Cliente", "Categoria", "Subcategoria"
-        ])
+        # tabela com as colunas solicitadas (modelo: só as células visíveis são lidas)
+        self.table = QTableView()
+        self.model = RowsTableModel(self.HEADERS, parent=self)
+        self.table.setModel(self.model)
+        # "Valor" fica float no modelo; o R$ é montado pelo delegate na pintura
+        self.table.setItemDelegateForColumn(0, BRLDelegate(self.table))
+        self.table.verticalHeader().setVisible(False)
         stretch_table(self.table); zebra_table(self.table)
         self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
@@ -2798,15 +3792,20 @@ class CashflowDialog(QDialog):
         # total
         self.lbTotal = QLabel("Total: R$ 0,00")
 
+        # paginação
+        self.spPage = QSpinBox(); self.spPage.setRange(1, 1)
+        self.lbPages = QLabel("de 1")
+
         # botões
         btAtualizar = QPushButton("Atualizar")
         btAtualizar.setIcon(std_icon(self, self.style().SP_BrowserReload))
         btPdf = QPushButton("Exportar PDF");       btPdf.setIcon(std_icon(self, self.style().SP_DriveDVDIcon))
         btCsv = QPushButton("Exportar Excel/CSV"); btCsv.setIcon(std_icon(self, self.style().SP_DialogSaveButton))
-        btPdf.clicked.connect(lambda: export_pdf_from_table(self, self.table, "Fluxo_de_Caixa"))
-        btCsv.clicked.connect(lambda: export_excel_from_table(self, self.table, "Fluxo_de_Caixa"))
+        btPdf.clicked.connect(lambda: export_pdf_rows(self, self.HEADERS, self._export_rows, "Fluxo_de_Caixa"))
+        btCsv.clicked.connect(lambda: export_excel_rows(self, self.HEADERS, self._export_rows, "Fluxo_de_Caixa"))
         btAtualizar.clicked.connect(self.load)
         self.cbBank.currentIndexChanged.connect(self.load)
+        self.spPage.valueChanged.connect(self.load_page)
 
         # linha superior (período + atualizar + banco)
         form = QHBoxLayout()
@@ -2823,69 +3822,75 @@ class CashflowDialog(QDialog):
         lay.addWidget(self.table)
         lay.addWidget(self.lbTotal)
         hl = QHBoxLayout(); hl.addWidget(btPdf); hl.addWidget(btCsv); hl.addStretch()
+        hl.addWidget(QLabel("Página:")); hl.addWidget(self.spPage); hl.addWidget(self.lbPages)
         lay.addLayout(hl)
 
         self.load()
         enable_autosize(self, 0.85, 0.75, 1100, 650)
 
+    def _filters(self):
+        return (self.company_id, qdate_to_iso(self.dtIni.date()),
+                qdate_to_iso(self.dtFim.date()), self.cbBank.currentData())
+
+    def _export_rows(self):
+        for valor, tipo, data_liq, entidade, categoria, subcategoria in self.db.cashflow_iter(*self._filters()):
+            yield [fmt_brl(valor or 0.0), tipo, iso_to_br(data_liq), entidade, categoria, subcategoria]
+
     def load(self):
         """
         Lista pagamentos (apenas de lançamentos LIQUIDADOS) no período,
         com sinal positivo para RECEBER e negativo para PAGAR.
-        Filtro opcional por banco.
+        Filtro opcional por banco. Total e nº de páginas vêm do banco;
+        a grade mostra só a página atual.
         """
-        dt_ini = qdate_to_iso(self.dtIni.date())
-        dt_fim = qdate_to_iso(self.dtFim.date())
-        bank_id = self.cbBank.currentData()
-
-        sql = """
-            SELECT
-                CASE WHEN t.tipo='RECEBER'
-                     THEN (p.amount + p.interest - p.discount)
-                     ELSE -(p.amount + p.interest - p.discount)
-                END AS valor,
-                t.tipo AS tipo,
-                p.payment_date AS data_liq,
-                IFNULL(e.razao_social,'') AS entidade,
-                IFNULL(c.name,'') AS categoria,
-                IFNULL(s.name,'') AS subcategoria
-            FROM payments p
-            JOIN transactions t     ON t.id = p.transaction_id
-            LEFT JOIN entities e     ON e.id = t.entity_id
-            LEFT JOIN categories c   ON c.id = t.category_id
-            LEFT JOIN subcategories s ON s.id = t.subcategory_id
-            WHERE p.company_id = ?
-              AND date(p.payment_date) BETWEEN date(?) AND date(?)
-              AND t.status = 'LIQUIDADO'
-        """
-        params = [self.company_id, dt_ini, dt_fim]
-        if bank_id:
-            sql += " AND p.bank_id = ?"
-            params.append(bank_id)
-        sql += " ORDER BY date(p.payment_date)"
-
-        rows = self.db.q(sql, tuple(params))
+        self._fetch(0, True)
+
+    def load_page(self, *args):
+        self._fetch((self.spPage.value() - 1) * self.PAGE_SIZE, False)
+
+    @staticmethod
+    def _query(db, filters, limit, offset, with_resumo):
+        resumo = db.cashflow_resumo(*filters) if with_resumo else None
+        return resumo, db.cashflow(*filters, limit=limit, offset=offset)
+
+    def _fetch(self, offset, with_resumo):
+        # consultas no pool; _query_seq descarta respostas atrasadas
+        self._query_seq += 1
+        seq = self._query_seq
+        self._query_job = start_query(
+            self.db, self._query, self._filters(), self.PAGE_SIZE, offset, with_resumo,
+            on_done=lambda res, seq=seq: self._populate(seq, res),
+        )
 
-        # preenche tabela
-        self.table.setRowCount(0)
-        total = 0.0
-        for r in rows:
-            row = self.table.rowCount(); self.table.insertRow(row)
-            val = float(r["valor"] or 0.0)
-            total += val
-            self.table.setItem(row, 0, QTableWidgetItem(fmt_brl(val)))
-            self.table.setItem(row, 1, QTableWidgetItem(r["tipo"]))
-            self.table.setItem(row, 2, QTableWidgetItem(iso_to_br(r["data_liq"])))
-            self.table.setItem(row, 3, QTableWidgetItem(r["entidade"]))
-            self.table.setItem(row, 4, QTableWidgetItem(r["categoria"]))
-            self.table.setItem(row, 5, QTableWidgetItem(r["subcategoria"]))
-
-        self.lbTotal.setText(f"Total: {fmt_brl(total)}")
+    def _populate(self, seq, res):
+        if seq != self._query_seq:
+            return
+        self._query_job = None
+        if isinstance(res, Exception):
+            msg_err(str(res), self)
+            return
+        resumo, rows = res
+        if resumo is not None:
+            n, total = resumo
+            self.lbTotal.setText(f"Total: {fmt_brl(total)}")
+            pages = max(1, -(-n // self.PAGE_SIZE))
+            self.lbPages.setText(f"de {pages}")
+            self.spPage.blockSignals(True)
+            self.spPage.setRange(1, pages)
+            self.spPage.setValue(1)
+            self.spPage.blockSignals(False)
+
+        # valor cru (formatado pelo BRLDelegate); o modelo troca tudo num único reset
+        self.model.set_rows([
+            (valor or 0.0, tipo, iso_to_br(data_liq), entidade, categoria, subcategoria)
+            for valor, tipo, data_liq, entidade, categoria, subcategoria in rows
+        ])
 
 # ===== [SUBSTITUA A CLASSE DREDialog INTEIRA POR ESTA] ======================
 class DREDialog(QDialog):
     def __init__(self, db: DB, company_id: int, parent=None):
         super().__init__(parent); self.db=db; self.company_id=company_id
+        self._query_seq = 0; self._query_job = None
         self.setWindowTitle("Demonstração de Resultado (DRE)")
 
         self.spAno=QSpinBox(); self.spAno.setRange(2000,2099); self.spAno.setValue(date.today().year)
@@ -2955,26 +3960,43 @@ class DREDialog(QDialog):
         # Sem CSS global: tudo inline (Qt respeita melhor)
         return ""
 
+    @staticmethod
+    def _query(db, company_id, ano, mes, reg):
+        return db.dre(company_id, ano, mes, reg), db.dre_retencoes_por_sub(company_id, ano, mes, reg)
+
     def gerar(self):
+        # consultas no pool; o HTML é montado quando o resultado chega
+        self._query_seq += 1
+        seq = self._query_seq
+        self._query_job = start_query(
+            self.db, self._query, self.company_id, self.spAno.value(),
+            self.spMes.value() or None, self.cbReg.currentText(),
+            on_done=lambda res, seq=seq: self._render(seq, res),
+        )
+
+    def _render(self, seq, res):
         """
         Monta o HTML do DRE.
         - Abre a <table> com <colgroup> para 2 colunas de largura fixa.
         - 'Margem Líquida' sem colspan (preserva a divisória central) e com bordas.
         """
-        ano = self.spAno.value()
-        mes = self.spMes.value() or None
-        reg = self.cbReg.currentText()
+        if seq != self._query_seq:
+            return
+        self._query_job = None
+        if isinstance(res, Exception):
+            msg_err(str(res), self)
+            return
 
-        # Totais por categoria
-        rows = self.db.dre(self.company_id, ano, mes, reg)
+        # Totais por categoria + retenções detalhadas
+        rows, ret_map = res
+        rec_total = float(rows[0]["total_receber"] or 0.0) if rows else 0.0
+        pag_total = float(rows[0]["total_pagar"] or 0.0) if rows else 0.0
         rec_rows = [r for r in rows if r["tipo"] == "RECEBER"]
         pag_rows = [
             r for r in rows
             if r["tipo"] == "PAGAR" and (r["categoria"] or "").upper() != "DESPESAS COM IMPOSTOS"
         ]
 
-        # Retenções detalhadas
-        ret_map = self.db.dre_retencoes_por_sub(self.company_id, ano, mes, reg)
         total_ret = sum(ret_map.values())
 
         # ===== HTML =====
@@ -2989,11 +4011,8 @@ class DREDialog(QDialog):
         # --- CONTAS A RECEBER ---
         html.append(self._cab("CONTAS A RECEBER"))
         z = False
-        rec_total = 0.0
         for r in rec_rows:
-            v = float(r["total"] or 0.0)
-            rec_total += v
-            html.append(self._linha(r["categoria"], v, negativo=False, zebra=z))
+            html.append(self._linha(r["categoria"], float(r["total"] or 0.0), negativo=False, zebra=z))
             z = not z
 
         html.append('<tr class="sep"><td colspan="2"></td></tr>')
@@ -3010,11 +4029,8 @@ class DREDialog(QDialog):
         # --- CONTAS A PAGAR (sem impostos) ---
         html.append(self._cab("CONTAS A PAGAR"))
         z = False
-        pag_total = 0.0
         for r in pag_rows:
-            v = float(r["total"] or 0.0)
-            pag_total += v
-            html.append(self._linha(r["categoria"], v, negativo=True, zebra=z))
+            html.append(self._linha(r["categoria"], float(r["total"] or 0.0), negativo=True, zebra=z))
             z = not z
 
         # --- MARGEM LÍQUIDA (box com bordas fechadas) ---
@@ -3067,12 +4083,8 @@ class DREDialog(QDialog):
             return
         if not fn.lower().endswith(".pdf"):
             fn += ".pdf"
-        doc_html = self.view.toHtml()
-        doc = QTextDocument()
-        doc.setHtml(doc_html)
-        pr = QPrinter(QPrinter.HighResolution)
-        pr.setOutputFormat(QPrinter.PdfFormat)
-        pr.setPageSizeMM(QSizeF(211.67, 211.67))  # ~800x800 px a 96 dpi (aprox)
+        doc = _get_pdf_document(self.view.toHtml())
+        pr = _get_pdf_printer()
         pr.setOutputFileName(fn)
         doc.print_(pr)
         msg_info(f"PDF gerado em:\n{fn}", self)
@@ -3213,6 +4225,7 @@ class LoginWindow(QWidget):
         self.btEntrar = QPushButton("Entrar")
         self.btEntrar.setIcon(std_icon(self, self.style().SP_DialogOkButton))
         self.btEntrar.clicked.connect(self.login)
+        self._kdf_job = None
 
         # ⟵ ADICIONE ESTA LINHA
         self.edPass.returnPressed.connect(self.btEntrar.click)
@@ -3295,7 +4308,24 @@ class LoginWindow(QWidget):
     def login(self):
         company_id = self.cbEmp.currentData()
         username = self.cbUser.currentData()
-        user = self.db.verify_login(company_id, username, self.edPass.text())
+        password = self.edPass.text()
+        u = self.db.login_user(username)
+        if u is None:
+            msg_err("Login inválido ou sem acesso à empresa.")
+            return
+        # KDF (scrypt/PBKDF2) fora da thread da UI; o resto do login volta para cá
+        self.btEntrar.setEnabled(False)
+        # expected: se ainda em PBKDF2, o registro scrypt da migração também sai do pool
+        self._kdf_job = KdfRunnable(password, u["password_salt"], u["kdf"], u["iterations"],
+                                    expected=u["password_hash"])
+        self._kdf_job.signals.done.connect(
+            lambda calc, rec, cid=company_id, u=u, pw=password: self._login_done(cid, u, pw, calc, rec))
+        QThreadPool.globalInstance().start(self._kdf_job)
+
+    def _login_done(self, company_id, u, password, calc, new_record=None):
+        self._kdf_job = None
+        self.btEntrar.setEnabled(True)
+        user = self.db.finish_login(company_id, u, password, calc, new_record)
         if not user:
             msg_err("Login inválido ou sem acesso à empresa.")
             return
@@ -3576,7 +4606,8 @@ def main():
     conn=ensure_db(); db=DB(conn)
     app=QApplication(sys.argv)
     login=LoginWindow(db); login.show()
-    sys.exit(app.exec_())
+    rc=app.exec_(); db.close()
+    sys.exit(rc)
 
 if __name__ == "__main__":
     conn = ensure_db()
@@ -3585,4 +4616,6 @@ if __name__ == "__main__":
     app.setApplicationName(APP_TITLE)
     w = LoginWindow(db)
     w.show()
-    sys.exit(app.exec_())
+    rc = app.exec_()
+    db.close()
+    sys.exit(rc)